@@ -0,0 +1,254 @@
+import numpy as np
+
+import dungeongrams
+
+'''
+Struct-of-arrays simulation of many dungeongrams states at once.
+
+step_batch advances N states under N actions and matches Game.step exactly.
+'''
+
+NO_MOVE = len(dungeongrams.ACTIONS)
+
+
+
+class StateBatch:
+    # cells are flat indices rr * width + cc; switches and food are masks over the shared switchcells and foodcells
+    def __init__(self, width, exitcell, switchcells, foodcells, count, enemycount):
+        self.width = width
+        self.exitcell = exitcell
+        self.switchcells = np.asarray(switchcells, dtype=np.int64)
+        self.foodcells = np.asarray(foodcells, dtype=np.int64)
+
+        self.player = np.zeros(count, dtype=np.int64)
+        self.stamina = np.zeros(count, dtype=np.int64)
+        self.enemies = np.zeros((count, enemycount), dtype=np.int64)
+        self.enemymv = np.zeros(count, dtype=bool)
+        self.switches = np.zeros((count, len(switchcells)), dtype=bool)
+        self.food = np.zeros((count, len(foodcells)), dtype=bool)
+        self.didwin = np.zeros(count, dtype=bool)
+        self.didlose = np.zeros(count, dtype=bool)
+
+    def __len__(self):
+        return len(self.player)
+
+    def clone(self):
+        return self.take(np.arange(len(self)))
+
+    def take(self, indices):
+        ret = StateBatch(self.width, self.exitcell, self.switchcells, self.foodcells, 0, self.enemies.shape[1])
+        ret.player = self.player[indices]
+        ret.stamina = self.stamina[indices]
+        ret.enemies = self.enemies[indices]
+        ret.enemymv = self.enemymv[indices]
+        ret.switches = self.switches[indices]
+        ret.food = self.food[indices]
+        ret.didwin = self.didwin[indices]
+        ret.didlose = self.didlose[indices]
+        return ret
+
+    @staticmethod
+    def fromstates(level, states):
+        width = level.width
+        exit = states[0].exit
+        for state in states:
+            if state.exit != exit:
+                raise RuntimeError('states do not share an exit')
+            if len(state.enemies) != len(states[0].enemies):
+                raise RuntimeError('states do not share enemies')
+
+        # lists in a state are in row-major load order, so the sorted union keeps every state's order
+        switchcells = sorted(set(rr * width + cc for state in states for rr, cc in state.switches))
+        foodcells = sorted(set(rr * width + cc for state in states for rr, cc in state.food))
+        switchindex = {cell: ii for ii, cell in enumerate(switchcells)}
+        foodindex = {cell: ii for ii, cell in enumerate(foodcells)}
+
+        ret = StateBatch(width, exit[0] * width + exit[1], switchcells, foodcells, len(states), len(states[0].enemies))
+        for ii, state in enumerate(states):
+            ret.player[ii] = state.player[0] * width + state.player[1]
+            ret.stamina[ii] = state.stamina
+            for jj, (rr, cc) in enumerate(state.enemies):
+                ret.enemies[ii, jj] = rr * width + cc
+            ret.enemymv[ii] = state.enemymv
+            for rr, cc in state.switches:
+                ret.switches[ii, switchindex[rr * width + cc]] = True
+            for rr, cc in state.food:
+                ret.food[ii, foodindex[rr * width + cc]] = True
+            ret.didwin[ii] = state.didwin
+            ret.didlose[ii] = state.didlose
+        return ret
+
+    def tostates(self):
+        width = self.width
+        exit = divmod(self.exitcell, width)
+        switchcells = [divmod(int(cell), width) for cell in self.switchcells]
+        foodcells = [divmod(int(cell), width) for cell in self.foodcells]
+
+        states = []
+        for ii in range(len(self)):
+            state = dungeongrams.State()
+            state.player = divmod(int(self.player[ii]), width)
+            state.stamina = int(self.stamina[ii])
+            state.exit = exit
+            state.enemies = [divmod(int(cell), width) for cell in self.enemies[ii]]
+            state.enemymv = bool(self.enemymv[ii])
+            state.switches = [cell for cell, remaining in zip(switchcells, self.switches[ii]) if remaining]
+            state.food = [cell for cell, remaining in zip(foodcells, self.food[ii]) if remaining]
+            state.didwin = bool(self.didwin[ii])
+            state.didlose = bool(self.didlose[ii])
+            states.append(state)
+        return states
+
+
+
+class BatchTables:
+    # numpy copies of a level's compiled tables, with an extra all -1 row for NO_MOVE
+    def __init__(self, level):
+        if level.compiled is None:
+            level.compiled = dungeongrams.CompiledLevel(level)
+        compiled = level.compiled
+
+        nomove = [-1] * compiled.size
+        self.neighbors = np.array([compiled.neighbors[action] for action in dungeongrams.ACTIONS] + [nomove], dtype=np.int64)
+        self.enemyneighbors = np.array([compiled.enemyneighbors[action] for action in dungeongrams.ACTIONS] + [nomove], dtype=np.int64)
+        self.hazard = np.frombuffer(bytes(compiled.hazard), dtype=np.uint8).astype(bool)
+        self.enemyst = [(strr, stcc) for strr, stcc in level.enemyst]
+
+def get_tables(level):
+    tables = getattr(level, 'batchtables', None)
+    if tables is None:
+        tables = BatchTables(level)
+        level.batchtables = tables
+    return tables
+
+def action_indices(actions):
+    if isinstance(actions, np.ndarray) and actions.dtype.kind in 'iu':
+        indices = actions.astype(np.int64)
+    else:
+        indices = []
+        for action in actions:
+            if action not in dungeongrams.ACTIONS:
+                raise RuntimeError('unrecognized action')
+            indices.append(dungeongrams.ACTIONS.index(action))
+        indices = np.array(indices, dtype=np.int64)
+
+    if len(indices) > 0 and (indices.min() < 0 or indices.max() >= len(dungeongrams.ACTIONS)):
+        raise RuntimeError('unrecognized action')
+    return indices
+
+def occupied(cells, mask, dest):
+    # whether dest[ii] is one of the cells still set in mask[ii]
+    if len(cells) == 0:
+        return np.zeros(len(dest), dtype=bool)
+    return (mask & (cells[None, :] == dest[:, None])).any(axis=1)
+
+def step_batch(level, states, actions):
+    tables = get_tables(level)
+    width = states.width
+    exitcell = states.exitcell
+    count = len(states)
+
+    actions = action_indices(actions)
+    if len(actions) != count:
+        raise RuntimeError('need one action per state')
+
+    new = states.clone()
+    active = ~(new.didwin | new.didlose)
+
+    # player movement
+    dest = tables.neighbors[actions, new.player]
+    moveok = active & (dest >= 0) & ~((dest == exitcell) & new.switches.any(axis=1))
+    new.player = np.where(moveok, dest, new.player)
+
+    def collide():
+        return (new.enemies == new.player[:, None]).any(axis=1) | tables.hazard[new.player]
+
+    lose = active & collide()
+    new.didlose |= lose
+    rest = active & ~lose
+
+    win = rest & (new.player == exitcell)
+    new.didwin |= win
+    rest &= ~win
+
+    onswitch = new.switches & (new.switchcells[None, :] == new.player[:, None])
+    hitswitch = rest & onswitch.any(axis=1)
+    new.switches &= ~(onswitch & hitswitch[:, None])
+    rest &= ~hitswitch
+
+    onfood = new.food & (new.foodcells[None, :] == new.player[:, None])
+    hitfood = rest & onfood.any(axis=1)
+    new.food &= ~(onfood & hitfood[:, None])
+    new.stamina = np.where(hitfood, np.minimum(new.stamina + dungeongrams.STAMINA_FOOD, dungeongrams.STAMINA_STARTING), new.stamina)
+
+    # enemies move every other step, one after the other so earlier moves block later ones
+    moving = active & new.enemymv
+    new.enemymv = np.where(active, ~new.enemymv, new.enemymv)
+
+    if moving.any():
+        prr = new.player // width
+        pcc = new.player % width
+
+        for ii, (strr, stcc) in enumerate(tables.enemyst):
+            inrange = (prr - strr)**2 + (pcc - stcc)**2 <= dungeongrams.ENEMY_RANGE**2
+            tgrr = np.where(inrange, prr, strr)
+            tgcc = np.where(inrange, pcc, stcc)
+
+            ecell = new.enemies[:, ii]
+            err = ecell // width
+            ecc = ecell % width
+            edr = tgrr - err
+            edc = tgcc - ecc
+
+            vert = np.where(edr > 0, dungeongrams.ACTIONS.index('s'), np.where(edr < 0, dungeongrams.ACTIONS.index('w'), NO_MOVE))
+            horz = np.where(edc > 0, dungeongrams.ACTIONS.index('d'), np.where(edc < 0, dungeongrams.ACTIONS.index('a'), NO_MOVE))
+            vertfirst = (np.abs(edr) > np.abs(edc)) | ((np.abs(edr) == np.abs(edc)) & ((err + ecc) % 2 == 0))
+
+            pending = moving.copy()
+            for trymove in (np.where(vertfirst, vert, horz), np.where(vertfirst, horz, vert)):
+                edest = tables.enemyneighbors[trymove, ecell]
+                ok = pending & (edest >= 0) & (edest != exitcell)
+                ok &= ~(new.enemies == edest[:, None]).any(axis=1)
+                ok &= ~occupied(new.switchcells, new.switches, edest)
+                ok &= ~occupied(new.foodcells, new.food, edest)
+                new.enemies[:, ii] = np.where(ok, edest, new.enemies[:, ii])
+                pending &= ~ok
+
+    new.didlose |= active & collide()
+
+    new.stamina = np.where(active, new.stamina - 1, new.stamina)
+    if (new.stamina < 0).any():
+        raise RuntimeError('negative stamina')
+    new.didlose |= active & (new.stamina == 0)
+
+    return new
+
+def successors_batch(level, states):
+    # every state under every action, ordered state-major like the loop over ACTIONS in dosolve
+    nactions = len(dungeongrams.ACTIONS)
+    expanded = states.take(np.repeat(np.arange(len(states)), nactions))
+    actions = np.tile(np.arange(nactions, dtype=np.int64), len(states))
+    return step_batch(level, expanded, actions), actions
+
+def replay_batch(level, state, action_lists):
+    # replay many action sequences from one start state; positions is (N, T + 1) with -1 after a sequence ends
+    count = len(action_lists)
+    steps = max([len(actions) for actions in action_lists] + [0])
+
+    states = StateBatch.fromstates(level, [state] * count)
+    positions = np.full((count, steps + 1), -1, dtype=np.int64)
+    positions[:, 0] = states.player
+
+    padded = np.zeros((count, steps), dtype=np.int64)
+    for ii, actions in enumerate(action_lists):
+        padded[ii, :len(actions)] = action_indices(actions)
+    lengths = np.array([len(actions) for actions in action_lists], dtype=np.int64)
+
+    for tt in range(steps):
+        live = np.flatnonzero(lengths > tt)
+        stepped = step_batch(level, states.take(live), padded[live, tt])
+        for name in ['player', 'stamina', 'enemies', 'enemymv', 'switches', 'food', 'didwin', 'didlose']:
+            getattr(states, name)[live] = getattr(stepped, name)
+        positions[live, tt + 1] = stepped.player
+
+    return states, positions
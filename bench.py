@@ -0,0 +1,186 @@
+from typing import Dict, List, Tuple
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+import dungeongrams
+
+'''
+Solver benchmark over the bundled level corpora.
+
+  python bench.py run --output bench.json
+  python bench.py compare baseline.json bench.json
+'''
+
+# name -> (source, partial)
+SUITES = {
+    'full': (os.path.join('levels', 'full'), False),
+    'part': (os.path.join('levels', 'part'), True),
+    'train': ('train', True),
+    'other': ('other_training_levels', True),
+    'difficulty': (os.path.join('difficulty', 'output.json'), False),
+}
+
+FLAWS = [dungeongrams.FLAW_NO_FLAW, dungeongrams.FLAW_NO_SPEED]
+
+def solve_once(rows: List[str], partial: bool, thorough: bool, flaw: str, heuristic: str, frontier: str, timeout: float, memory: bool) -> Dict:
+    level, state = dungeongrams.Game.load(rows, False, partial)
+    stats = dungeongrams.SolveStats()
+
+    if memory:
+        tracemalloc.start()
+
+    start = time.perf_counter()
+    try:
+        solved, actions = dungeongrams.solve_for_run(level, state.clone(), thorough, flaw, time.time() + timeout, heuristic, stats, frontier=frontier)
+        error = None
+    except RuntimeError as e:
+        solved, actions = None, None
+        error = str(e)
+    elapsed = time.perf_counter() - start
+
+    peak_memory = None
+    if memory:
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    playability = None
+    if error is None:
+        didwin, _, best_switches, best_cols, _, _ = dungeongrams.run(level, state.clone(), actions, solved, False, False)
+        playability = 1.0 if didwin else dungeongrams.completion(level, best_switches, best_cols)
+
+    return {
+        'time': elapsed,
+        'expanded': stats.expanded,
+        'popped': stats.popped,
+        'peak_frontier': stats.peak_frontier,
+        'stop_reason': stats.stop_reason,
+        'peak_memory': peak_memory,
+        'playability': playability,
+        'error': error,
+    }
+
+def run_benchmark(suites: List[str], thorough_modes: List[bool], flaws: List[str], heuristic: str, frontiers: List[str], timeout: float, memory: bool) -> Dict:
+    results = []
+    for suite in suites:
+        source, partial = SUITES[suite]
+        for name, rows in dungeongrams.load_level_sources(source):
+            for thorough in thorough_modes:
+                for flaw in flaws:
+                    for frontier in frontiers:
+                        result = solve_once(rows, partial, thorough, flaw, heuristic, frontier, timeout, False)
+
+                        # peak memory comes from a separate traced run, since tracing slows the solver down
+                        if memory and result['error'] is None:
+                            result['peak_memory'] = solve_once(rows, partial, thorough, flaw, heuristic, frontier, timeout, True)['peak_memory']
+
+                        result.update({ 'suite': suite, 'level': name, 'thorough': thorough, 'flaw': flaw, 'heuristic': heuristic, 'frontier': frontier })
+                        results.append(result)
+
+                        sys.stderr.write('%-10s %-40s %-8s %-8s %-6s %8.3fs %9d expanded %s\n' % (suite, name, 'thorough' if thorough else 'quick', flaw, frontier, result['time'], result['expanded'], result['error'] or ''))
+
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'solver_version': dungeongrams.SOLVER_VERSION,
+            'timeout': timeout,
+            'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+        },
+        'results': results,
+    }
+
+def result_key(result: Dict) -> Tuple:
+    # results from before the frontier was selectable used the heap
+    return (result['suite'], result['level'], result['thorough'], result['flaw'], result['heuristic'], result.get('frontier', dungeongrams.FRONTIER_HEAP))
+
+def compare(baseline: Dict, current: Dict, tolerance: float, min_time: float) -> List[str]:
+    # returns a description of each regression of current against baseline
+    baseline_results = {result_key(result): result for result in baseline['results']}
+
+    regressions = []
+    for result in current['results']:
+        key = result_key(result)
+        if key not in baseline_results:
+            continue
+        base = baseline_results[key]
+        desc = '%s %s %s %s %s' % (key[0], key[1], 'thorough' if key[2] else 'quick', key[3], key[5])
+
+        if base['error'] is None and result['error'] is not None:
+            regressions.append('%s: now fails with "%s"' % (desc, result['error']))
+            continue
+        if result['error'] is not None:
+            continue
+
+        if base['playability'] is not None and result['playability'] != base['playability']:
+            regressions.append('%s: playability %s -> %s' % (desc, base['playability'], result['playability']))
+
+        if result['time'] > base['time'] * (1.0 + tolerance) and result['time'] - base['time'] > min_time:
+            regressions.append('%s: time %.3fs -> %.3fs' % (desc, base['time'], result['time']))
+
+        if result['expanded'] > base['expanded'] * (1.0 + tolerance):
+            regressions.append('%s: expanded %d -> %d' % (desc, base['expanded'], result['expanded']))
+
+        if base['peak_memory'] is not None and result['peak_memory'] is not None and result['peak_memory'] > base['peak_memory'] * (1.0 + tolerance):
+            regressions.append('%s: peak memory %d -> %d' % (desc, base['peak_memory'], result['peak_memory']))
+
+    return regressions
+
+def summarize(data: Dict) -> None:
+    for suite in SUITES:
+        for thorough in [False, True]:
+            for flaw in FLAWS:
+                for frontier in dungeongrams.FRONTIERS:
+                    rows = [result for result in data['results'] if result['suite'] == suite and result['thorough'] == thorough and result['flaw'] == flaw and result.get('frontier', dungeongrams.FRONTIER_HEAP) == frontier]
+                    if len(rows) == 0:
+                        continue
+                    print('%-10s %-8s %-8s %-6s %4d levels %9.2fs %10d expanded %3d errors' % (
+                        suite, 'thorough' if thorough else 'quick', flaw, frontier, len(rows),
+                        sum(result['time'] for result in rows),
+                        sum(result['expanded'] for result in rows),
+                        sum(1 for result in rows if result['error'] is not None)))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='DungeonGrams solver benchmark.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help='Run the benchmark.')
+    run_parser.add_argument('--suites', type=str, nargs='+', choices=list(SUITES), default=list(SUITES), help='Level corpora to run.')
+    run_parser.add_argument('--modes', type=str, nargs='+', choices=['quick', 'thorough'], default=['quick', 'thorough'], help='Search modes to run.')
+    run_parser.add_argument('--flaws', type=str, nargs='+', choices=FLAWS, default=FLAWS, help='Solver flaws to run.')
+    run_parser.add_argument('--heuristic', type=str, choices=dungeongrams.HEURISTICS, default=dungeongrams.HEURISTIC_EUCLID, help='Solver heuristic.')
+    run_parser.add_argument('--frontiers', type=str, nargs='+', choices=dungeongrams.FRONTIERS, default=dungeongrams.FRONTIERS, help='Solver frontiers to run.')
+    run_parser.add_argument('--timeout', type=float, default=60.0, help='Time limit in seconds per solve.')
+    run_parser.add_argument('--no-memory', action='store_true', help='Skip the traced runs that measure peak memory.')
+    run_parser.add_argument('--output', type=str, default='bench.json', help='Output json file.')
+
+    compare_parser = subparsers.add_parser('compare', help='Compare a benchmark run against a baseline.')
+    compare_parser.add_argument('baseline', type=str, help='Baseline json file.')
+    compare_parser.add_argument('current', type=str, help='Current json file.')
+    compare_parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed relative increase before flagging a regression.')
+    compare_parser.add_argument('--min-time', type=float, default=0.05, help='Ignore time increases smaller than this many seconds.')
+
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        data = run_benchmark(args.suites, [mode == 'thorough' for mode in args.modes], args.flaws, args.heuristic, args.frontiers, args.timeout, not args.no_memory)
+        with open(args.output, 'w') as f:
+            json.dump(data, f, indent=1)
+        summarize(data)
+        print('output in ' + args.output)
+
+    elif args.command == 'compare':
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.current) as f:
+            current = json.load(f)
+
+        regressions = compare(baseline, current, args.tolerance, args.min_time)
+        for regression in regressions:
+            print(regression)
+        print('%d regressions' % len(regressions))
+        sys.exit(1 if len(regressions) > 0 else 0)
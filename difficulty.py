@@ -1,9 +1,12 @@
-from typing import List, Tuple
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
 from tqdm import tqdm
 from math import floor
-import json
+import argparse
+import concurrent.futures
 import os
 
+import numpy as np
+
 import dungeongrams
 
 '''
@@ -80,13 +83,74 @@ def linearity(level: List[str]) -> float:
 
     return count / num_tiles
 
+# the offsets of ENEMY_RADIUS as (x, y) columns, and the inverse manhattan distance each adds when its tile matches
+RADIUS_OFFSETS = np.array(ENEMY_RADIUS, dtype=np.int64)
+RADIUS_WEIGHTS = np.array([1/manhattan_distance(0, 0, x_mod, y_mod) for (x_mod, y_mod) in ENEMY_RADIUS], dtype=np.float64)
+
+def tile_array(levels: List[List[str]]) -> np.ndarray:
+    # levels of the same shape as an array of their tile bytes, indexed [level, y, x]
+    return np.frombuffer(''.join(''.join(level) for level in levels).encode('ascii'), dtype=np.uint8).reshape(len(levels), len(levels[0]), len(levels[0][0]))
+
+def path_neighbors(tiles: np.ndarray, paths: List[List[Tuple[int, int]]]) -> Tuple[np.ndarray, np.ndarray]:
+    # the tile at each ENEMY_RADIUS offset from each path cell, indexed [level, step, offset], with 0 for offsets
+    # outside the level and steps past the end of a path; and the length of each path
+    count, height, width = tiles.shape
+    lengths = np.array([len(path) for path in paths], dtype=np.int64)
+
+    on_path = np.arange(lengths.max())[None, :] < lengths[:, None]
+    cells = np.zeros((count, lengths.max(), 2), dtype=np.int64)
+    cells[on_path] = np.array([cell for path in paths for cell in path], dtype=np.int64)
+
+    _xs = cells[:, :, 1, None] + RADIUS_OFFSETS[None, None, :, 0]
+    _ys = cells[:, :, 0, None] + RADIUS_OFFSETS[None, None, :, 1]
+    inside = on_path[:, :, None] & (_xs >= 0) & (_ys >= 0) & (_xs < width) & (_ys < height)
+
+    flat = (np.arange(count) * height * width)[:, None, None] + np.clip(_ys, 0, height - 1) * width + np.clip(_xs, 0, width - 1)
+    return np.where(inside, tiles.reshape(-1)[flat], 0), lengths
+
+def proximity_batch(neighbors: np.ndarray, lengths: np.ndarray, tile: str) -> np.ndarray:
+    # proximity_to_enemies or proximity_to_food for each level; the terms are added one at a time in the order the
+    # loops add them, so the sums come out exactly the same, and padding after a path only adds zeros
+    terms = np.where(neighbors == ord(tile), RADIUS_WEIGHTS, 0.0).reshape(len(lengths), -1)
+    return np.cumsum(terms, axis=1)[:, -1] / lengths
+
+def tile_features(levels: List[List[str]], paths: List[List[Tuple[int, int]]]) -> List[Dict[str, float]]:
+    # proximity_to_enemies, proximity_to_food, density, linearity and food_density of each level, with the same
+    # values as those functions; levels of the same shape are computed together
+    features = [{} for _ in levels]
+
+    shapes = {}
+    for ii, level in enumerate(levels):
+        shapes.setdefault((len(level), len(level[0])), []).append(ii)
+
+    for (height, width), indices in shapes.items():
+        tiles = tile_array([levels[ii] for ii in indices])
+        shape_paths = [paths[ii] for ii in indices]
+        num_tiles = height * width
+
+        # one pass counting every tile of every level
+        counts = np.bincount((np.arange(len(indices))[:, None] * 256 + tiles.reshape(len(indices), -1)).ravel(), minlength=len(indices) * 256).reshape(len(indices), 256)
+        def count(chars: List[str]) -> np.ndarray:
+            return counts[:, [ord(c) for c in chars]].sum(axis=1)
+
+        neighbors, lengths = path_neighbors(tiles, shape_paths)
+
+        values = {
+            'proximity-to-enemies': proximity_batch(neighbors, lengths, '#'),
+            'proximity-to-food': proximity_batch(neighbors, lengths, '&'),
+            'density': count(SOLIDS) / num_tiles,
+            'linearity': count(['^', '#', '*']) / num_tiles,
+            'food-density': count(['&']) / num_tiles,
+        }
+        for jj, ii in enumerate(indices):
+            features[ii] = {name: float(value[jj]) for name, value in values.items()}
+
+    return features
+
 def percent_difference(a: float, b: float) -> float:
     return abs(a-b) / ((a+b)/2)
 
-with open(os.path.join('difficulty', 'output.json'), 'r') as f:
-    data = json.load(f)
-
-columns = [
+COLUMNS = [
     'level',
     'path-no-enemies',
     'path-nothing',
@@ -101,41 +165,46 @@ columns = [
     'proximity-to-food'
 ]
 
-readable_f = open('output.txt', 'w')
-computation_f = open('custom_difficulty.csv', 'w')
-computation_f.write(','.join(columns))
-computation_f.write('\n')
-
-baseline_f = open('baseline_difficulty.csv', 'w')
-baseline_f.write('level,difficulty\n')
-
-# i = 0
-data_iterator = tqdm(data)
-for lvl_key in data_iterator:
-    data_iterator.set_description(lvl_key)
-
-    # build levels
-    level = data[lvl_key]
-    level_no_enemies = [r.replace('#', '-').replace('^', '-') for r in level]
-    level_no_nothing = [r.replace('*', '-') for r in level_no_enemies]
-
-    # Find solution for level
-    solution_with_enemies = dungeongrams.solve_and_run(level, False, False, True, dungeongrams.FLAW_NO_FLAW, False, False)
-    assert(solution_with_enemies[0])
-    path_with_enemies = solution_with_enemies[4]
-    stamina_with_enemies = solution_with_enemies[5]
-
-    # Find solution for level with no enemies
-    solution_no_enemies = dungeongrams.solve_and_run(level_no_enemies, False, False, True, dungeongrams.FLAW_NO_FLAW, False, False)
-    assert(solution_no_enemies[0])
-    path_no_enemies = solution_no_enemies[4]
-    stamina_no_enemies = solution_no_enemies[5]
-
-    # Find solution for level with no enemies or switches
-    solution_no_nothing = dungeongrams.solve_and_run(level_no_nothing, False, False, True, dungeongrams.FLAW_NO_FLAW, False, False)
-    assert(solution_no_nothing[0])
-    path_no_nothing = solution_no_nothing[4]
-    stamina_no_nothing = solution_no_nothing[5]
+CHECKPOINT_FILE = 'difficulty_checkpoint.txt'
+READABLE_FILE = 'output.txt'
+COMPUTATION_FILE = 'custom_difficulty.csv'
+BASELINE_FILE = 'baseline_difficulty.csv'
+
+def stream_levels(sources: List[str], partial: bool) -> Iterator[Tuple[str, List[str]]]:
+    # sources can be json files of name -> rows, directories of level files, .dgc corpus files, or level files
+    for source in sources:
+        for lvl_key, level in dungeongrams.load_level_sources(source):
+            if partial:
+                level = dungeongrams.Game.padpartial(level)
+            yield lvl_key, level
+
+def baseline_difficulty(lvl_key: str) -> Optional[float]:
+    # only generated levels keyed like "2_8" carry their generation parameters
+    try:
+        D = 1 + (sum(float(x)/DG_RESOLUTION for x in lvl_key.split('_')) / 2.0) * 7.0
+    except ValueError:
+        return None
+    assert(D >= 1)
+    assert(D <= 7)
+    return D
+
+# the path and ending stamina of the level's solution, the solution with no enemies, and the solution with no
+# enemies or switches
+Solutions = List[Tuple[List[Tuple[int, int]], float]]
+
+FEATURE_BATCH = 64
+
+def solve_level(lvl_key: str, level: List[str]) -> Tuple[str, List[str], Solutions]:
+    # Find solutions for the level, the level with no enemies, and the level with no enemies or switches
+    solutions = dungeongrams.solve_variants(level, False, False, True, dungeongrams.FLAW_NO_FLAW, ['', '#^', '#^*'])
+
+    for solution in solutions:
+        assert(solution[0])
+
+    return lvl_key, level, [(solution[4], solution[5]) for solution in solutions]
+
+def difficulty_vector(solutions: Solutions, tile_values: Dict[str, float]) -> List[str]:
+    (path_with_enemies, stamina_with_enemies), (path_no_enemies, stamina_no_enemies), (path_no_nothing, stamina_no_nothing) = solutions
 
     # Build out the difficulty vector
     V = [ 
@@ -143,13 +212,13 @@ for lvl_key in data_iterator:
         len(path_with_enemies) - len(path_no_nothing),                # path difference no enemies and switches
         jaccard_similarity(path_with_enemies, path_no_enemies),       # path similarity no enemies
         jaccard_similarity(path_with_enemies, path_no_nothing),       # path similarity no enemies and switches
-        proximity_to_enemies(level, path_with_enemies),
+        tile_values['proximity-to-enemies'],
         percent_difference(stamina_with_enemies, stamina_no_enemies), # Percent difference of stamina at end no enemies
         percent_difference(stamina_with_enemies, stamina_no_nothing), # Percent difference of stamina at end no enemies and switches
-        density(level),                                               # Density of the level
-        linearity(level),                                             # linearity of the level
-        food_density(level),                                          # Density of food in the level
-        proximity_to_food(level, path_with_enemies),
+        tile_values['density'],                                       # Density of the level
+        tile_values['linearity'],                                     # linearity of the level
+        tile_values['food-density'],                                  # Density of food in the level
+        tile_values['proximity-to-food'],
     ]
 
     # convert to strings for convenience when writing
@@ -158,26 +227,151 @@ for lvl_key in data_iterator:
     # estimate = min(sum(V)/float(len(V)), 1)
     # likert = floor(estimate * (7 - 1)) + 1
 
-    # Write data to human readable file
-    readable_f.write(f'Level: {lvl_key}\n')
-    readable_f.write(','.join(V) + '\n')
-    readable_f.write('\n'.join(level))
-    readable_f.write('\n\n\n')
-
-    # Write difficulty vector to CSV for easier calculation
-    # computation_f.write(f'{lvl_key},{",".join(d for d in V)}\n')
-
-    # Write data for comparison to a baseline
-    D = 1 + (sum(float(x)/DG_RESOLUTION for x in lvl_key.split('_')) / 2.0) * 7.0
-    assert(D >= 1)
-    assert(D <= 7)
-    baseline_f.write(f'{lvl_key},{D}\n')
-
-    # i += 1
-    # if i >= 15:
-    #     break
-
-readable_f.close()
-baseline_f.close()
-computation_f.close()
-print('output in output.txt')
\ No newline at end of file
+    return V
+
+def batch_features(solved: List[Tuple[str, List[str], Solutions]]) -> List[Tuple[str, List[str], List[str]]]:
+    # level_features for levels from solve_level, with the tile features of the whole batch computed together
+    tile_values = tile_features([level for _, level, _ in solved], [solutions[0][0] for _, _, solutions in solved])
+    return [(lvl_key, level, difficulty_vector(solutions, values)) for (lvl_key, level, solutions), values in zip(solved, tile_values)]
+
+def level_features(lvl_key: str, level: List[str]) -> Tuple[str, List[str], List[str]]:
+    return batch_features([solve_level(lvl_key, level)])[0]
+
+def _solve_level(item: Tuple[str, List[str]]) -> Tuple[str, List[str], Solutions]:
+    return solve_level(*item)
+
+def read_checkpoint(out_dir: str) -> set:
+    checkpoint_path = os.path.join(out_dir, CHECKPOINT_FILE)
+    if not os.path.exists(checkpoint_path):
+        return set()
+    with open(checkpoint_path, 'r') as f:
+        return set(line.rstrip('\n') for line in f if line.strip())
+
+def read_written(out_dir: str) -> set:
+    # levels with a row in the CSV, which is written last for each level, so a crash before the checkpoint is
+    # written doesn't repeat the level; a row cut off by a crash is removed
+    computation_path = os.path.join(out_dir, COMPUTATION_FILE)
+    if not os.path.exists(computation_path):
+        return set()
+    with open(computation_path, 'rb+') as f:
+        data = f.read()
+        end = data.rfind(b'\n') + 1
+        if end < len(data):
+            f.truncate(end)
+    return set(line.split(',', 1)[0] for line in data[:end].decode().splitlines()[1:] if line.strip())
+
+def trim_unfinished(path: str, done: set, entry_key: Callable[[str], Optional[str]]) -> None:
+    # cuts a file back to its first entry for a level that isn't done; levels are written one at a time, so those are
+    # the entries a crash left before the level's CSV row; entry_key gives the level a line starts an entry for
+    if not os.path.exists(path):
+        return
+    with open(path, 'rb+') as f:
+        offset = 0
+        for line in f:
+            key = entry_key(line.decode())
+            if key is not None and key not in done:
+                break
+            offset += len(line)
+        f.truncate(offset)
+
+def readable_entry_key(line: str) -> Optional[str]:
+    return line[len('Level: '):].rstrip('\n') if line.startswith('Level: ') else None
+
+def baseline_entry_key(line: str) -> Optional[str]:
+    return None if line == 'level,difficulty\n' else line.split(',', 1)[0]
+
+def run_pipeline(sources: List[str], out_dir: str = '.', partial: bool = False, workers: Optional[int] = None, restart: bool = False) -> None:
+    os.makedirs(out_dir, exist_ok=True)
+
+    done = set() if restart else read_checkpoint(out_dir) | read_written(out_dir)
+    mode = 'a' if len(done) > 0 else 'w'
+    if mode == 'a':
+        trim_unfinished(os.path.join(out_dir, READABLE_FILE), done, readable_entry_key)
+        trim_unfinished(os.path.join(out_dir, BASELINE_FILE), done, baseline_entry_key)
+
+    readable_f = open(os.path.join(out_dir, READABLE_FILE), mode)
+    computation_f = open(os.path.join(out_dir, COMPUTATION_FILE), mode)
+    baseline_f = open(os.path.join(out_dir, BASELINE_FILE), mode)
+    checkpoint_f = open(os.path.join(out_dir, CHECKPOINT_FILE), mode)
+
+    if mode == 'w':
+        computation_f.write(','.join(COLUMNS))
+        computation_f.write('\n')
+        baseline_f.write('level,difficulty\n')
+
+    def write_level(lvl_key: str, level: List[str], V: List[str]) -> None:
+        # Write data to human readable file
+        readable_f.write(f'Level: {lvl_key}\n')
+        readable_f.write(','.join(V) + '\n')
+        readable_f.write('\n'.join(level))
+        readable_f.write('\n\n\n')
+
+        # Write data for comparison to a baseline
+        D = baseline_difficulty(lvl_key)
+        if D is not None:
+            baseline_f.write(f'{lvl_key},{D}\n')
+
+        # Write difficulty vector to CSV for easier calculation; it goes last, once the other rows are on disk, since
+        # resuming skips levels in it and trims the other files back to them
+        readable_f.flush()
+        baseline_f.flush()
+        computation_f.write(f'{lvl_key},{",".join(d for d in V)}\n')
+        computation_f.flush()
+
+        checkpoint_f.write(lvl_key + '\n')
+        checkpoint_f.flush()
+
+    pending_levels = ((lvl_key, level) for lvl_key, level in stream_levels(sources, partial) if lvl_key not in done)
+    progress = tqdm(desc='levels')
+
+    # solved levels wait for their features until there are FEATURE_BATCH of them
+    batch = []
+    def write_batch() -> None:
+        for features in batch_features(batch):
+            write_level(*features)
+        progress.update(len(batch))
+        batch.clear()
+
+    def add_solved(solved: Tuple[str, List[str], Solutions]) -> None:
+        batch.append(solved)
+        if len(batch) >= FEATURE_BATCH:
+            write_batch()
+
+    try:
+        if workers == 1:
+            for lvl_key, level in pending_levels:
+                add_solved(solve_level(lvl_key, level))
+        else:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+                # keep a bounded number of levels in flight so sources are streamed rather than loaded up front
+                max_in_flight = 2 * (workers or os.cpu_count() or 1)
+                in_flight = set()
+                for item in pending_levels:
+                    in_flight.add(executor.submit(_solve_level, item))
+                    if len(in_flight) >= max_in_flight:
+                        finished, in_flight = concurrent.futures.wait(in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+                        for future in finished:
+                            add_solved(future.result())
+                for future in concurrent.futures.as_completed(in_flight):
+                    add_solved(future.result())
+        if len(batch) > 0:
+            write_batch()
+    finally:
+        progress.close()
+        readable_f.close()
+        baseline_f.close()
+        computation_f.close()
+        checkpoint_f.close()
+
+    print('output in ' + os.path.join(out_dir, READABLE_FILE))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='DungeonGrams difficulty features.')
+    parser.add_argument('sources', type=str, nargs='*', help='Level sources: json files of levels, directories of level files, .dgc corpus files, or level files.', default=[os.path.join('difficulty', 'output.json')])
+    parser.add_argument('--partial', action='store_true', help='Add player and exit to partial levels.')
+    parser.add_argument('--out-dir', type=str, help='Directory for output files and the checkpoint.', default='.')
+    parser.add_argument('--workers', type=int, help='Number of worker processes.', default=None)
+    parser.add_argument('--restart', action='store_true', help='Ignore any checkpoint and start over.')
+    args = parser.parse_args()
+
+    run_pipeline(args.sources, args.out_dir, args.partial, args.workers, args.restart)
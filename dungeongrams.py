@@ -1,4 +1,4 @@
-import argparse, heapq, math, pprint, random, sys
+import argparse, array, concurrent.futures, hashlib, heapq, json, math, mmap, multiprocessing, os, pprint, queue, random, re, socketserver, sqlite3, stat, struct, sys, threading, time
 from os.path import isfile
 
 ACTIONS = [ ' ', 'w', 'a', 's', 'd' ]
@@ -8,6 +8,8 @@ STAMINA_FOOD        = 30
 
 ENEMY_RANGE = 3
 
+ENEMY_MOVE_MEMO_SIZE = 1 << 18
+
 CHAR_BLANK          = '-'
 CHAR_PLAYER_PLAYING = '@'
 CHAR_PLAYER_WON     = '!'
@@ -22,6 +24,22 @@ CHAR_BLOCK          = 'X'
 CHAR_STRUCTURE_1    = '/'
 CHAR_STRUCTURE_2    = '\\'
 
+# characters a level file can contain
+LEVEL_CHARS = [
+    CHAR_BLANK,
+    CHAR_PLAYER_PLAYING,
+    CHAR_EXIT_OPEN,
+    CHAR_ENEMY,
+    CHAR_SWITCH,
+    CHAR_FOOD,
+    CHAR_SPIKE,
+    CHAR_BLOCK,
+    CHAR_STRUCTURE_1,
+    CHAR_STRUCTURE_2,
+]
+UNRECOGNIZED_CHAR_RE = re.compile('[^' + re.escape(''.join(LEVEL_CHARS)) + ']')
+LEVEL_CHAR_RES = { char: re.compile(re.escape(char)) for char in LEVEL_CHARS }
+
 FLAW_NO_FLAW = 'no_flaw'
 FLAW_NO_SPIKE = 'no_spike'
 FLAW_NO_HAZARD = 'no_hazard'
@@ -33,6 +51,41 @@ FLAWS = [
     FLAW_NO_SPEED
 ]
 
+# tiles the solver doesn't see with some flaws; it plans without them and the plan is run on the real level
+FLAW_REMOVES = {
+    FLAW_NO_SPIKE: CHAR_SPIKE,
+    FLAW_NO_HAZARD: CHAR_SPIKE + CHAR_ENEMY
+}
+
+# tiles that level variants can remove
+VARIANT_CHARS = [
+    CHAR_ENEMY,
+    CHAR_SWITCH,
+    CHAR_FOOD,
+    CHAR_SPIKE
+]
+
+HEURISTIC_EUCLID = 'euclid'
+HEURISTIC_DISTANCE = 'distance'
+HEURISTICS = [
+    HEURISTIC_EUCLID,
+    HEURISTIC_DISTANCE
+]
+
+# bump whenever a change can alter solver results, so old cached results are not reused
+SOLVER_VERSION = 8
+
+SOLVE_CACHE_PATH = os.environ.get('DUNGEONGRAMS_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'dungeongrams', 'solve_cache.sqlite3'))
+SOLVE_CACHE_MAX_ENTRIES = 100000
+
+# parsed levels kept by each serving process
+SERVE_LEVEL_CACHE_SIZE = 256
+
+# packed level corpus: header, then tiles, names and an index of fixed size entries
+CORPUS_MAGIC = b'DGC1'
+CORPUS_HEADER = struct.Struct('<4sQQ')  # magic, level count, index offset
+CORPUS_ENTRY = struct.Struct('<QQIHH')  # tiles offset, name offset, name length, height, width
+
 
 
 class State:
@@ -77,6 +130,135 @@ class State:
         ret.didlose = tup[8]
         return ret
 
+    def tokey(self, codec):
+        return codec.encode(self)
+
+    @staticmethod
+    def fromkey(codec, key):
+        return codec.decode(key)
+
+
+
+class StateCodec:
+    # packs a search state into a single int, from the low bits up:
+    # stamina, didlose, didwin, enemymv, player cell, enemy cells, remaining switch mask, remaining food mask;
+    # enemymv can be left out when nothing depends on it, in which case it always decodes as False
+    def __init__(self, level, state, enemymv=True):
+        self.width = level.width
+        self.exit = state.exit
+        self.enemymvmask = 1 if enemymv else 0
+
+        self.switches = list(state.switches)
+        self.food = list(state.food)
+        self.enemycount = len(state.enemies)
+
+        self.switchbit = {}
+        for ii, switch in enumerate(self.switches):
+            self.switchbit[switch] = 1 << ii
+        self.foodbit = {}
+        for ii, food in enumerate(self.food):
+            self.foodbit[food] = 1 << ii
+
+        self.cellbits = max(1, (level.width * level.height - 1).bit_length())
+        self.cellmask = (1 << self.cellbits) - 1
+        self.staminabits = max(STAMINA_STARTING, state.stamina).bit_length()
+        self.staminamask = (1 << self.staminabits) - 1
+
+        self.enemiesbits = self.enemycount * self.cellbits
+        self.enemiesmask = (1 << self.enemiesbits) - 1
+        self.switchmask = (1 << len(self.switches)) - 1
+
+        # order lists the remaining switches and food as slots holding their index plus one, with empty slots last,
+        # worked out once for each mask seen
+        self.switchslotbits = len(self.switches).bit_length() * len(self.switches)
+        self.foodslotbits = len(self.food).bit_length() * len(self.food)
+        self.switchslots = {}
+        self.foodslots = {}
+
+    def encode(self, state):
+        width = self.width
+        cellbits = self.cellbits
+
+        key = 0
+        for food in state.food:
+            key |= self.foodbit[food]
+        key <<= len(self.switches)
+        for switch in state.switches:
+            key |= self.switchbit[switch]
+        for rr, cc in state.enemies:
+            key = (key << cellbits) | (rr * width + cc)
+        key = (key << cellbits) | (state.player[0] * width + state.player[1])
+        key = (key << 3) | ((state.enemymv & self.enemymvmask) << 2) | (state.didwin << 1) | state.didlose
+        key = (key << self.staminabits) | state.stamina
+        return key
+
+    def decode(self, key):
+        width = self.width
+        cellbits = self.cellbits
+        cellmask = self.cellmask
+
+        ret = State()
+        ret.exit = self.exit
+
+        ret.stamina = key & self.staminamask
+        key >>= self.staminabits
+        ret.didlose = bool(key & 1)
+        ret.didwin = bool(key & 2)
+        ret.enemymv = bool(key & 4)
+        key >>= 3
+        ret.player = divmod(key & cellmask, width)
+        key >>= cellbits
+
+        enemies = []
+        for ii in range(self.enemycount):
+            enemies.append(divmod(key & cellmask, width))
+            key >>= cellbits
+        enemies.reverse()
+        ret.enemies = enemies
+
+        ret.switches = [switch for ii, switch in enumerate(self.switches) if (key >> ii) & 1]
+        key >>= len(self.switches)
+        ret.food = [food for ii, food in enumerate(self.food) if (key >> ii) & 1]
+        return ret
+
+    def order(self, key, enemymv):
+        # an int that sorts the same as the totuple() of the state key packs, with enemymv given since it may not
+        # be packed, so searches can break ties between equal priorities as they did when the frontier held tuples;
+        # the switches and food keep the level's order, so comparing them as sequences is comparing their slots
+        stamina = key & self.staminamask
+        key >>= self.staminabits
+        flags = key & 3
+        key >>= 3
+        player = key & self.cellmask
+        key >>= self.cellbits
+        enemies = key & self.enemiesmask
+        key >>= self.enemiesbits
+        switches = key & self.switchmask
+        food = key >> len(self.switches)
+
+        switchslots = self.switchslots.get(switches)
+        if switchslots is None:
+            switchslots = self.slots(switches, len(self.switches))
+            self.switchslots[switches] = switchslots
+        foodslots = self.foodslots.get(food)
+        if foodslots is None:
+            foodslots = self.slots(food, len(self.food))
+            self.foodslots[food] = foodslots
+
+        order = (((player << self.staminabits) | stamina) << self.enemiesbits) | enemies
+        order = (((order << 1) | enemymv) << self.switchslotbits) | switchslots
+        order = (((order << self.foodslotbits) | foodslots) << 2) | flags
+        return order
+
+    @staticmethod
+    def slots(mask, count):
+        slotbits = count.bit_length()
+        slots = 0
+        for ii in range(count):
+            if (mask >> ii) & 1:
+                slots = (slots << slotbits) | (ii + 1)
+        return slots << (slotbits * (count - bin(mask).count('1')))
+
 
 
 class Level:
@@ -89,6 +271,95 @@ class Level:
         self.spikes = set()
         self.enemyst = []
 
+        self.compiled = None
+
+
+
+class CompiledLevel:
+    # flat cell index tables for a level, indexed by rr * width + cc
+    def __init__(self, level):
+        self.width = level.width
+        self.height = level.height
+        self.size = level.width * level.height
+
+        self.cells = [divmod(ii, level.width) for ii in range(self.size)]
+
+        self.passable = bytearray(self.size)
+        self.hazard = bytearray(self.size)
+        for ii, rc in enumerate(self.cells):
+            if rc not in level.blocks:
+                self.passable[ii] = 1
+            if rc in level.spikes:
+                self.hazard[ii] = 1
+
+        # destination cell for each action from each cell, or -1 if the move is off the level or into a block
+        self.neighbors = {}
+        for action, (dr, dc) in zip(ACTIONS, [(0, 0), (-1, 0), (0, -1), (1, 0), (0, 1)]):
+            nbrs = []
+            for rr, cc in self.cells:
+                nr = rr + dr
+                nc = cc + dc
+                if 0 <= nr and nr < self.height and 0 <= nc and nc < self.width and self.passable[nr * self.width + nc]:
+                    nbrs.append(nr * self.width + nc)
+                else:
+                    nbrs.append(-1)
+            self.neighbors[action] = nbrs
+
+        # enemies can additionally never move onto spikes
+        self.enemyneighbors = {}
+        for action, nbrs in self.neighbors.items():
+            self.enemyneighbors[action] = [nn if nn >= 0 and not self.hazard[nn] else -1 for nn in nbrs]
+
+        self.enemyst = list(level.enemyst)
+
+        # candidate enemy moves keyed by (enemy index, enemy cell, player cell), cleared when full
+        self.enemymovememo = {}
+        self.enemymoveintern = {}
+
+    def cell(self, rc):
+        return rc[0] * self.width + rc[1]
+
+    def enemymoves(self, ii, ecell, pcell):
+        memokey = (ii * self.size + ecell) * self.size + pcell
+        moves = self.enemymovememo.get(memokey)
+        if moves is not None:
+            return moves
+
+        strr, stcc = self.enemyst[ii]
+        prr, pcc = self.cells[pcell]
+        err, ecc = self.cells[ecell]
+
+        stdr = prr - strr
+        stdc = pcc - stcc
+        if stdr * stdr + stdc * stdc <= ENEMY_RANGE * ENEMY_RANGE:
+            tgrr, tgcc = prr, pcc
+        else:
+            tgrr, tgcc = strr, stcc
+
+        edr = tgrr - err
+        edc = tgcc - ecc
+
+        vert = 's' if edr > 0 else ('w' if edr < 0 else None)
+        horz = 'd' if edc > 0 else ('a' if edc < 0 else None)
+        if abs(edr) > abs(edc) or (abs(edr) == abs(edc) and (err + ecc) % 2 == 0):
+            trymoves = (vert, horz)
+        else:
+            trymoves = (horz, vert)
+
+        # only keep moves that are not blocked by the static level
+        moves = []
+        for emove in trymoves:
+            if emove is not None and self.enemyneighbors[emove][ecell] >= 0:
+                moves.append(self.enemyneighbors[emove][ecell])
+        moves = tuple(moves)
+        moves = self.enemymoveintern.setdefault(moves, moves)
+
+        if len(self.enemymovememo) >= ENEMY_MOVE_MEMO_SIZE:
+            self.enemymovememo.clear()
+        self.enemymovememo[memokey] = moves
+
+        return moves
+
 
 
 class Game:
@@ -274,115 +545,179 @@ class Game:
         return newstate
 
     @staticmethod
-    def display(level, state):
-        for cc in range(level.width + 2):
-            sys.stdout.write(CHAR_BLOCK)
-        sys.stdout.write('\n')
-
-        for rr in range(level.height):
-            sys.stdout.write(CHAR_BLOCK)
-            for cc in range(level.width):
-                if (rr, cc) == state.player:
-                    if state.didlose:
-                        sys.stdout.write(CHAR_PLAYER_LOST)
-                    elif state.didwin:
-                        sys.stdout.write(CHAR_PLAYER_WON)
-                    else:
-                        sys.stdout.write(CHAR_PLAYER_PLAYING)
-                elif (rr, cc) in state.enemies:
-                    sys.stdout.write(CHAR_ENEMY)
-                elif (rr, cc) in level.spikes:
-                    sys.stdout.write(CHAR_SPIKE)
-                elif (rr, cc) in state.switches:
-                    sys.stdout.write(CHAR_SWITCH)
-                elif (rr, cc) in state.food:
-                    sys.stdout.write(CHAR_FOOD)
-                elif (rr, cc) == state.exit:
-                    if len(state.switches) == 0:
-                        sys.stdout.write(CHAR_EXIT_OPEN)
-                    else:
-                        sys.stdout.write(CHAR_EXIT_CLOSED)
-                elif (rr, cc) in level.blocks:
-                    sys.stdout.write(CHAR_BLOCK)
-                else:
-                    sys.stdout.write('-')
-            sys.stdout.write(CHAR_BLOCK)
-            sys.stdout.write('\n')
+    def stepfast(level, state, action):
+        # same as step, using the level's compiled tables
+        compiled = level.compiled
+        width = compiled.width
+        cells = compiled.cells
 
-        for cc in range(level.width + 2):
-            sys.stdout.write(CHAR_BLOCK)
-        sys.stdout.write('\n')
+        newstate = state.clone()
+
+        if newstate.didwin:
+            return newstate
+        if newstate.didlose:
+            return newstate
+
+        if action not in compiled.neighbors:
+            raise RuntimeError('unrecognized action')
+
+        pcell = compiled.neighbors[action][newstate.player[0] * width + newstate.player[1]]
+        if pcell >= 0:
+            pnrc = cells[pcell]
+            if pnrc != newstate.exit or len(newstate.switches) == 0:
+                newstate.player = pnrc
+
+        if newstate.player in newstate.enemies or compiled.hazard[newstate.player[0] * width + newstate.player[1]]:
+            newstate.didlose = True
+
+        elif newstate.player == newstate.exit:
+            newstate.didwin = True
+
+        elif newstate.player in newstate.switches:
+            del newstate.switches[newstate.switches.index(newstate.player)]
+
+        elif newstate.player in newstate.food:
+            newstate.stamina = min(newstate.stamina + STAMINA_FOOD, STAMINA_STARTING)
+            del newstate.food[newstate.food.index(newstate.player)]
+
+        if not newstate.enemymv:
+            newstate.enemymv = True
+        else:
+            newstate.enemymv = False
+
+            size = compiled.size
+            memo = compiled.enemymovememo
+            enemies = newstate.enemies
+            pcell = newstate.player[0] * width + newstate.player[1]
+
+            for ii in range(len(enemies)):
+                err, ecc = enemies[ii]
+                ecell = err * width + ecc
+
+                moves = memo.get((ii * size + ecell) * size + pcell)
+                if moves is None:
+                    moves = compiled.enemymoves(ii, ecell, pcell)
+
+                # occupancy by the exit, other enemies, switches and food changes from state to state
+                for encell in moves:
+                    enrc = cells[encell]
+                    if enrc == newstate.exit or enrc in enemies or enrc in newstate.switches or enrc in newstate.food:
+                        continue
+                    enemies[ii] = enrc
+                    break
+
+        if newstate.player in newstate.enemies or compiled.hazard[newstate.player[0] * width + newstate.player[1]]:
+            newstate.didlose = True
+
+        newstate.stamina -= 1
+        if newstate.stamina < 0:
+                raise RuntimeError('negative stamina')
+        if newstate.stamina == 0:
+            newstate.didlose = True
 
-        sys.stdout.write('stamina: %d\n' % state.stamina)
-        sys.stdout.write('\n')
+        return newstate
 
     @staticmethod
-    def load(filename, is_file, partial):
-        level = Level()
-        state = State()
+    def display(level, state):
+        sys.stdout.write(Renderer(level).render(state))
 
-        state.stamina = STAMINA_STARTING
+    @staticmethod
+    def readrows(filename):
+        rows = []
+        with open(filename) as level_file:
+            for line in level_file.readlines():
+                rows.append(line.strip())
+        return rows
+
+    @staticmethod
+    def padpartial(rows):
+        # add a player to the start and an exit to the end of a partial level
+        newrows = []
+        for rr, row in enumerate(rows):
+            pref = (CHAR_PLAYER_PLAYING + CHAR_BLANK) if rr == 0             else (CHAR_BLANK + CHAR_BLANK)
+            suff = (CHAR_BLANK + CHAR_EXIT_OPEN)      if rr + 1 == len(rows) else (CHAR_BLANK + CHAR_BLANK)
+            newrows.append(pref + row + suff)
+        return newrows
 
+    @staticmethod
+    def load(filename, is_file, partial):
         if is_file:
-            rows = []
-            with open(filename) as level_file:
-                for line in level_file.readlines():
-                    rows.append(line.strip())
+            rows = Game.readrows(filename)
         else:
             rows = list(filename)
 
         if partial:
-            newrows = []
-            for rr, row in enumerate(rows):
-                pref = (CHAR_PLAYER_PLAYING + CHAR_BLANK) if rr == 0             else (CHAR_BLANK + CHAR_BLANK)
-                suff = (CHAR_BLANK + CHAR_EXIT_OPEN)      if rr + 1 == len(rows) else (CHAR_BLANK + CHAR_BLANK)
-                newrows.append(pref + row + suff)
-            rows = newrows
+            rows = Game.padpartial(rows)
 
+        width = 0
         for row in rows:
-            if level.width == 0:
-                level.width = len(row)
-            elif level.width != len(row):
+            if width == 0:
+                width = len(row)
+            elif width != len(row):
                 raise RuntimeError('rows not all same length')
-        level.height = len(rows)
 
-        for rr, row in enumerate(rows):
-            for cc, char in enumerate(row):
-                if char == '-':
-                    pass
-                elif char == CHAR_BLOCK:
-                    level.blocks.add((rr, cc))
-                elif char == CHAR_STRUCTURE_1:
-                    level.blocks.add((rr, cc))
-                elif char == CHAR_STRUCTURE_2:
-                    level.blocks.add((rr, cc))
-                elif char == CHAR_ENEMY:
-                    state.enemies.append((rr, cc))
-                    level.enemyst.append((rr, cc))
-                elif char == CHAR_SPIKE:
-                    level.spikes.add((rr, cc))
-                elif char == CHAR_SWITCH:
-                    state.switches.append((rr, cc))
-                    level.switchcount += 1
-                elif char == CHAR_FOOD:
-                    state.food.append((rr, cc))
-                elif char == CHAR_PLAYER_PLAYING:
-                    if state.player != None:
-                        raise RuntimeError('multiple players found')
-                    state.player = (rr, cc)
-                elif char == CHAR_EXIT_OPEN:
-                    if state.exit != None:
-                        raise RuntimeError('multiple exits found')
-                    state.exit = (rr, cc)
+        return Game.loadtiles(''.join(rows), width, len(rows))
 
-                else:
-                    raise RuntimeError(f'unrecognized character: {char}')
+    _tilecoords = {}
+
+    @staticmethod
+    def tilecoords(width, size):
+        # (row, col) of each index into a level's joined tiles, shared by levels of the same shape
+        coords = Game._tilecoords.get((width, size))
+        if coords is None:
+            if len(Game._tilecoords) >= 64:
+                Game._tilecoords.clear()
+            coords = [divmod(index, width) for index in range(size)]
+            Game._tilecoords[(width, size)] = coords
+        return coords
+
+    @staticmethod
+    def loadtiles(tiles, width, height):
+        # tiles is the rows joined together; each kind of tile is found with one scan rather than checking each character
+        level = Level()
+        state = State()
+
+        state.stamina = STAMINA_STARTING
+        level.width = width
+        level.height = height
+
+        unrecognized = UNRECOGNIZED_CHAR_RE.search(tiles)
+        if unrecognized is not None:
+            raise RuntimeError(f'unrecognized character: {unrecognized.group()}')
+
+        coords = Game.tilecoords(width, len(tiles))
+        def cells(char):
+            return [coords[match.start()] for match in LEVEL_CHAR_RES[char].finditer(tiles)]
+
+        for char in [CHAR_BLOCK, CHAR_STRUCTURE_1, CHAR_STRUCTURE_2]:
+            level.blocks.update(cells(char))
+        level.spikes.update(cells(CHAR_SPIKE))
+
+        state.enemies = cells(CHAR_ENEMY)
+        level.enemyst = list(state.enemies)
+
+        state.switches = cells(CHAR_SWITCH)
+        level.switchcount = len(state.switches)
 
-        if state.player == None:
+        state.food = cells(CHAR_FOOD)
+
+        players = cells(CHAR_PLAYER_PLAYING)
+        if len(players) > 1:
+            raise RuntimeError('multiple players found')
+        exits = cells(CHAR_EXIT_OPEN)
+        if len(exits) > 1:
+            raise RuntimeError('multiple exits found')
+
+        if len(players) == 0:
             raise RuntimeError('no player found')
-        if state.exit == None:
+        if len(exits) == 0:
             raise RuntimeError('no exit found')
 
+        state.player = players[0]
+        state.exit = exits[0]
+
+        level.compiled = CompiledLevel(level)
+
         return level, state
 
 
@@ -408,6 +743,374 @@ class Game:
 
 
 
+RENDER_FULL = 'full'
+RENDER_DIFF = 'diff'
+RENDERS = [
+    RENDER_FULL,
+    RENDER_DIFF
+]
+
+# seconds between the frames of an exported asciicast animation
+ANIMATION_FRAME_TIME = 0.1
+
+class Renderer:
+    # draws states of a level over a background of the tiles that never change; in diff mode, frames after the
+    # first are ANSI escapes that redraw only what changed, with the cursor left just below the frame
+    def __init__(self, level, mode=RENDER_FULL, out=None, newline='\n'):
+        if mode not in RENDERS:
+            raise RuntimeError('unrecognized render mode')
+
+        self.level = level
+        self.mode = mode
+        self.out = out
+        self.newline = newline
+        self.previous = None
+
+        self.width = level.width + 2
+        self.height = level.height + 2
+        background = [CHAR_BLANK] * (self.width * self.height)
+        for cc in range(self.width):
+            background[cc] = CHAR_BLOCK
+            background[(self.height - 1) * self.width + cc] = CHAR_BLOCK
+        for rr in range(self.height):
+            background[rr * self.width] = CHAR_BLOCK
+            background[rr * self.width + self.width - 1] = CHAR_BLOCK
+        for rr, cc in level.blocks:
+            background[(rr + 1) * self.width + cc + 1] = CHAR_BLOCK
+        for rr, cc in level.spikes:
+            background[(rr + 1) * self.width + cc + 1] = CHAR_SPIKE
+        self.background = background
+
+    def frame(self, state, action=None):
+        # the lines of a frame; tiles that can share a cell are drawn in increasing order of precedence
+        width = self.width
+        cells = list(self.background)
+
+        rr, cc = state.exit
+        cells[(rr + 1) * width + cc + 1] = CHAR_EXIT_OPEN if len(state.switches) == 0 else CHAR_EXIT_CLOSED
+        for rr, cc in state.food:
+            cells[(rr + 1) * width + cc + 1] = CHAR_FOOD
+        for rr, cc in state.switches:
+            cells[(rr + 1) * width + cc + 1] = CHAR_SWITCH
+        for rr, cc in state.enemies:
+            cells[(rr + 1) * width + cc + 1] = CHAR_ENEMY
+
+        rr, cc = state.player
+        if state.didlose:
+            cells[(rr + 1) * width + cc + 1] = CHAR_PLAYER_LOST
+        elif state.didwin:
+            cells[(rr + 1) * width + cc + 1] = CHAR_PLAYER_WON
+        else:
+            cells[(rr + 1) * width + cc + 1] = CHAR_PLAYER_PLAYING
+
+        lines = [''.join(cells[ii:ii + width]) for ii in range(0, len(cells), width)]
+        lines.append('stamina: %d' % state.stamina)
+        lines.append('')
+
+        # full frames are printed after their action, as the solver always has
+        if action is not None:
+            if self.mode == RENDER_FULL:
+                lines.insert(0, action)
+            else:
+                lines[-1] = 'action: %s' % action
+        return lines
+
+    def render(self, state, action=None):
+        lines = self.frame(state, action)
+        previous, self.previous = self.previous, lines
+
+        if self.mode == RENDER_FULL or previous is None or len(previous) != len(lines):
+            return self.newline.join(lines) + self.newline
+
+        text = ['\x1b[%dF' % len(lines)]
+        down = 0
+        for old, new in zip(previous, lines):
+            if old != new:
+                if down > 0:
+                    text.append('\x1b[%dE' % down)
+                first = 0
+                while first < min(len(old), len(new)) and old[first] == new[first]:
+                    first += 1
+                if len(old) == len(new):
+                    last = len(new)
+                    while new[last - 1] == old[last - 1]:
+                        last -= 1
+                    text.append('\x1b[%dG%s' % (first + 1, new[first:last]))
+                else:
+                    text.append('\x1b[%dG%s\x1b[K' % (first + 1, new[first:]))
+                down = 0
+            down += 1
+        text.append('\x1b[%dE' % down)
+        return ''.join(text)
+
+    def show(self, state, action=None):
+        out = self.out if self.out is not None else sys.stdout
+        out.write(self.render(state, action))
+
+def write_animation(path, level, states, actions):
+    # states[0] is the start and states[ii + 1] follows actions[ii]; .cast files get an asciicast v2 animation of ANSI
+    # diffs, and anything else the full frames as text
+    with open(path, 'w') as f:
+        if path.endswith('.cast'):
+            renderer = Renderer(level, RENDER_DIFF, newline='\r\n')
+            f.write(json.dumps({ 'version': 2, 'width': renderer.width, 'height': renderer.height + 3, 'timestamp': int(time.time()) }) + '\n')
+            f.write(json.dumps([0.0, 'o', '\x1b[2J\x1b[H' + renderer.render(states[0])]) + '\n')
+            for ii, action in enumerate(actions):
+                f.write(json.dumps([round((ii + 1) * ANIMATION_FRAME_TIME, 3), 'o', renderer.render(states[ii + 1], action)]) + '\n')
+        else:
+            renderer = Renderer(level, RENDER_FULL, f)
+            renderer.show(states[0])
+            for ii, action in enumerate(actions):
+                renderer.show(states[ii + 1], action)
+
+
+
+class SolveCache:
+    # persistent solver results in sqlite, evicting least recently used entries past max_entries;
+    # each process and thread opens its own connection so the cache can be shared by pool workers and server threads
+    def __init__(self, path, max_entries):
+        self.path = path
+        self.max_entries = max_entries
+        self.local = threading.local()
+
+    def connect(self):
+        # a forked process keeps the forking thread's local values, so the pid is checked too
+        local = self.local
+        if getattr(local, 'conn', None) is None or local.conn_pid != os.getpid():
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            local.conn = sqlite3.connect(self.path, timeout=60.0, isolation_level=None)
+            local.conn.execute('PRAGMA journal_mode=WAL')
+            local.conn.execute('CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT NOT NULL, used REAL NOT NULL)')
+            local.conn.execute('CREATE INDEX IF NOT EXISTS results_used ON results (used)')
+            local.conn_pid = os.getpid()
+        return local.conn
+
+    @staticmethod
+    def key(rows, partial, thorough, flaw, options):
+        # options holds any other solver settings that can change the result
+        desc = json.dumps([SOLVER_VERSION, [row.strip() for row in rows], bool(partial), bool(thorough), flaw, options], sort_keys=True)
+        return hashlib.sha256(desc.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        conn = self.connect()
+        row = conn.execute('SELECT value FROM results WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        conn.execute('UPDATE results SET used = ? WHERE key = ?', (time.time(), key))
+        return json.loads(row[0])
+
+    def put(self, key, value):
+        conn = self.connect()
+        conn.execute('INSERT OR REPLACE INTO results (key, value, used) VALUES (?, ?, ?)', (key, json.dumps(value), time.time()))
+        excess = conn.execute('SELECT COUNT(*) FROM results').fetchone()[0] - self.max_entries
+        if excess > 0:
+            conn.execute('DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY used LIMIT ?)', (excess,))
+
+_solve_cache = None
+
+def get_solve_cache():
+    global _solve_cache
+    if _solve_cache is None:
+        _solve_cache = SolveCache(SOLVE_CACHE_PATH, SOLVE_CACHE_MAX_ENTRIES)
+    return _solve_cache
+
+
+
+STOP_GOAL = 'goal'
+STOP_EXHAUSTED = 'exhausted'
+STOP_STATE_LIMIT = 'state_limit'
+STOP_DEADLINE = 'deadline'
+STOP_CACHED = 'cached'
+STOP_BUDGET = 'budget'
+
+FRONTIER_HEAP = 'heap'
+FRONTIER_BUCKET = 'bucket'
+FRONTIERS = [
+    FRONTIER_HEAP,
+    FRONTIER_BUCKET,
+]
+
+# bucket frontier priorities are rounded down to multiples of 1 / FRONTIER_BUCKET_SCALE
+FRONTIER_BUCKET_SCALE = 1
+
+# heuristic weights tried in turn by the anytime solver, ending with plain A*
+ANYTIME_WEIGHTS = [5.0, 3.0, 2.0, 1.5, 1.0]
+
+# boundary states carried from one window to the next by the segmented solver
+SEGMENT_BEAM = 8
+
+# parallel searches are only used for levels with at least this many cells; each worker expands this many states
+# between sending the states it generated for other workers, and sends them early once this many are waiting
+PARALLEL_MIN_CELLS = 500
+PARALLEL_EXPAND = 64
+PARALLEL_BATCH = 256
+
+# how much solver output is checked by replaying it: not at all, the trajectory run uses, or also every step of
+# the paths searches reconstruct
+VERIFY_NONE = 0
+VERIFY_RUN = 1
+VERIFY_SEARCH = 2
+VERIFY_LEVELS = [
+    VERIFY_NONE,
+    VERIFY_RUN,
+    VERIFY_SEARCH
+]
+
+_solver_verify = VERIFY_NONE
+
+def set_solver_verify(verify):
+    global _solver_verify
+    if verify not in VERIFY_LEVELS:
+        raise RuntimeError('unrecognized verify level')
+    _solver_verify = verify
+
+class SolveBudget:
+    # wall-clock and/or popped node budget shared by the searches of an anytime solve
+    def __init__(self, ms=None, nodes=None):
+        self.deadline = None
+        if ms is not None:
+            self.deadline = time.time() + ms / 1000.0
+        self.nodes = nodes
+
+    def spend(self, pop_count):
+        # called on every pop; returns True once the budget has run out
+        if self.nodes is not None:
+            self.nodes -= 1
+            if self.nodes < 0:
+                return True
+        return self.deadline is not None and pop_count % 256 == 0 and time.time() > self.deadline
+
+    def exhausted(self):
+        if self.nodes is not None and self.nodes <= 0:
+            return True
+        return self.deadline is not None and time.time() > self.deadline
+
+class SolveStats:
+    # filled in by dosolve when passed in
+    def __init__(self):
+        self.popped = 0
+        self.expanded = 0
+        self.pruned_switches = 0
+        self.stale = 0
+        self.pushed = 0
+        self.duplicates = 0
+        self.dominated = 0
+        self.peak_frontier = 0
+        self.nodes = 0
+        self.stop_reason = None
+
+        self.time_total = 0.0
+        self.time_step = 0.0
+        self.time_heuristic = 0.0
+        self.time_reconstruct = 0.0
+
+    def timed(self, fn, attr):
+        def _timed(*args):
+            start = time.perf_counter()
+            ret = fn(*args)
+            setattr(self, attr, getattr(self, attr) + time.perf_counter() - start)
+            return ret
+        return _timed
+
+class Trajectory:
+    # filled in by the solver when passed in, with what happens along the actions it returns: the player position,
+    # stamina and number of remaining switches at the start and after each step, up to a step that wins or loses
+    def __init__(self):
+        self.positions = None
+        self.stamina = None
+        self.switches = None
+        self.didwin = False
+        self.didlose = False
+
+    def recorded(self):
+        return self.positions is not None
+
+    def record(self, states):
+        self.positions = []
+        self.stamina = []
+        self.switches = []
+        self.didwin = False
+        self.didlose = False
+        for state in states:
+            self.positions.append(state.player)
+            self.stamina.append(state.stamina)
+            self.switches.append(len(state.switches))
+            if state.didwin or state.didlose:
+                self.didwin, self.didlose = state.didwin, state.didlose
+                break
+
+    def best(self, level):
+        # the most switches hit and furthest column reached, not counting a step that loses
+        steps = len(self.positions)
+        if self.didlose:
+            steps -= 1
+        best_switches = level.switchcount - min(self.switches[:steps])
+        best_cols = max(cc for _, cc in self.positions[:steps]) + 1
+        return best_switches, best_cols
+
+    def totuple(self):
+        return (self.positions, self.stamina, self.switches, self.didwin, self.didlose)
+
+
+
+class HeapFrontier:
+    # binary heap of (priority, tiebreak, node, cost); equal priorities pop in tiebreak order
+    def __init__(self):
+        self.heap = []
+
+    def __len__(self):
+        return len(self.heap)
+
+    def push(self, priority, tiebreak, node, cost):
+        heapq.heappush(self.heap, (priority, tiebreak, node, cost))
+
+    def pop(self):
+        _, _, node, cost = heapq.heappop(self.heap)
+        return node, cost
+
+class BucketFrontier:
+    # (node, cost) lists keyed by quantized priority, with a heap of the keys in use;
+    # the lowest bucket pops first, most recently pushed first
+    def __init__(self, scale=FRONTIER_BUCKET_SCALE):
+        self.scale = scale
+        self.buckets = {}
+        self.bucket_keys = []
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def push(self, priority, tiebreak, node, cost):
+        bucket_key = math.floor(priority * self.scale)
+        bucket = self.buckets.get(bucket_key)
+        if bucket is None:
+            bucket = []
+            self.buckets[bucket_key] = bucket
+            heapq.heappush(self.bucket_keys, bucket_key)
+        bucket.append((node, cost))
+        self.count += 1
+
+    def pop(self):
+        bucket_key = self.bucket_keys[0]
+        bucket = self.buckets[bucket_key]
+        entry = bucket.pop()
+        if len(bucket) == 0:
+            del self.buckets[bucket_key]
+            heapq.heappop(self.bucket_keys)
+        self.count -= 1
+        return entry
+
+def make_frontier(frontier):
+    if frontier == FRONTIER_HEAP:
+        return HeapFrontier()
+    elif frontier == FRONTIER_BUCKET:
+        return BucketFrontier()
+    else:
+        raise RuntimeError('unrecognized frontier')
+
+
+
 def completion(level, best_switches, best_cols):
     return 0.9 * ((best_switches + (best_cols / level.width)) / (level.switchcount + 1.0))
 
@@ -421,98 +1124,582 @@ def heur(level, state):
             closest_dist_sqr = min(closest_dist_sqr, (state.player[0] - switch[0])**2 + (state.player[1] - switch[1])**2)
         return -state.stamina + closest_dist_sqr**0.5 + len(state.switches) * (level.width + level.height)
 
+def distance_field(level, reachable, source):
+    # grid distance from source to every cell in reachable, None elsewhere
+    compiled = level.compiled
+    field = [None] * compiled.size
+    field[compiled.cell(source)] = 0
+    processing = [source]
+    while len(processing) > 0:
+        next_processing = []
+        for curr in processing:
+            dist = field[compiled.cell(curr)] + 1
+            for dr, dc in [(-1, 0), (1, 0), (0, -1), (0, 1)]:
+                nbr = (curr[0] + dr, curr[1] + dc)
+                if nbr in reachable and field[compiled.cell(nbr)] is None:
+                    field[compiled.cell(nbr)] = dist
+                    next_processing.append(nbr)
+        processing = next_processing
+    return field
+
+class DistanceHeuristic:
+    # admissible and consistent: distance to the nearest remaining switch, plus a minimum spanning tree
+    # over the remaining switches and the exit, or the distance to the exit once all switches are hit
+    admissible = True
+
+    def __init__(self, level, state, reachable, fields=None):
+        self.compiled = level.compiled
+        self.exit = state.exit
+        self.switches = list(state.switches)
+        self.switchindex = {switch: ii for ii, switch in enumerate(self.switches)}
+
+        # fields can be shared between heuristics for levels with the same blocks and spikes, keyed by the
+        # reachable cells and then the source
+        if fields is not None:
+            fields = fields.setdefault(frozenset(reachable), {})
+        def field(source):
+            if fields is None:
+                return distance_field(level, reachable, source)
+            if source not in fields:
+                fields[source] = distance_field(level, reachable, source)
+            return fields[source]
+
+        self.exitfield = field(self.exit)
+        self.switchfields = [field(switch) for switch in self.switches]
+
+        # pairwise distances between switches, with the exit last
+        targets = self.switches + [self.exit]
+        self.pairdist = [[field[self.compiled.cell(target)] for target in targets] for field in self.switchfields + [self.exitfield]]
+
+        self.mstmemo = {}
+
+    def mst(self, remaining):
+        # Prim's algorithm over the remaining switch indices and the exit
+        if remaining in self.mstmemo:
+            return self.mstmemo[remaining]
+
+        nodes = list(remaining) + [len(self.switches)]
+        best = {node: self.pairdist[nodes[-1]][node] for node in nodes[:-1]}
+        total = 0
+        while len(best) > 0:
+            node = min(best, key=best.get)
+            total += best.pop(node)
+            for other in best:
+                best[other] = min(best[other], self.pairdist[node][other])
+
+        self.mstmemo[remaining] = total
+        return total
+
+    def __call__(self, level, state):
+        if state.didwin:
+            return 0
+        if state.didlose:
+            return math.inf
+
+        pcell = self.compiled.cell(state.player)
+        if len(state.switches) == 0:
+            dist = self.exitfield[pcell]
+            return math.inf if dist is None else dist
+
+        remaining = tuple(self.switchindex[switch] for switch in state.switches)
+        closest = None
+        for ii in remaining:
+            dist = self.switchfields[ii][pcell]
+            if dist is not None and (closest is None or dist < closest):
+                closest = dist
+        if closest is None:
+            return math.inf
+        return closest + self.mst(remaining)
+
 def compl_guess(level, state):
     return completion(level, level.switchcount - len(state.switches), state.player[1])
 
-def dosolve(level, state, thorough, slow):
+def dosolve(level, state, thorough, slow, deadline=None, heuristic=heur, stats=None, weight=1.0, budget=None, cost_bound=None, explored=None, frontier=FRONTIER_HEAP, trajectory=None):
     # adapted from https://www.redblobgames.com/pathfinding/a-star/implementation.html
     start = state.clone()
-    start_tup = start.totuple()
+    codec = StateCodec(level, start, slow or len(start.enemies) > 0)
+
+    if level.compiled is None:
+        level.compiled = CompiledLevel(level)
+    start_key = codec.encode(start)
 
     if start.exit in start.enemies:
             raise RuntimeError('enemy starts on exit')
     if start.exit in level.spikes:
             raise RuntimeError('spike on exit')
 
-    frontier = []
-    heapq.heappush(frontier, (0, start_tup, start))
+    # with an admissible heuristic, states can be pruned against the cost bound using their estimate too
+    bound_heuristic = getattr(heuristic, 'admissible', False)
 
-    came_from = {}
-    cost_so_far = {}
-    came_from[start_tup] = (None, None)
-    cost_so_far[start_tup] = 0
+    step = Game.stepfast
+    if stats is not None:
+        solve_start_time = time.perf_counter()
+        step = stats.timed(step, 'time_step')
+        heuristic = stats.timed(heuristic, 'time_heuristic')
+
+    # node arena: per-node packed state, parent node, action index and cost, plus the node for each state
+    node_key = [start_key]
+    node_parent = array.array('i', [-1])
+    node_action = bytearray([0])
+    node_cost = array.array('i', [0])
+    key_node = { start_key: 0 }
+
+    # a state is dominated by one that differs only in having more stamina and was reached at no greater cost;
+    # this maps the rest of the key to the (stamina, cost) pairs seen that no other pair dominates
+    staminabits = codec.staminabits
+    staminamask = codec.staminamask
+    key_front = { start_key >> staminabits: [(start.stamina, 0)] }
+
+    # entries carry the node's cost when pushed, so ones left behind by a cheaper path can be skipped
+    frontier = make_frontier(frontier)
+    frontier.push(0, codec.order(start_key, start.enemymv), 0, 0)
 
     best_state_guess = 0.0
-    best_state_tup = start_tup
+    best_node = 0
 
     min_switches = len(start.switches)
     state_count = 0
+    pop_count = 0
+    stop_reason = STOP_EXHAUSTED
 
     while len(frontier) > 0:
-        current_pri, current_tup, current = heapq.heappop(frontier)
+        if stats is not None:
+            stats.popped += 1
+            stats.peak_frontier = max(stats.peak_frontier, len(frontier))
+
+        current_node, current_cost = frontier.pop()
+        if current_cost > node_cost[current_node]:
+            if stats is not None:
+                stats.stale += 1
+            continue
+
+        current = codec.decode(node_key[current_node])
+
+        pop_count += 1
+        if deadline is not None:
+            # only check the clock every so often
+            if pop_count % 1024 == 0 and time.time() > deadline:
+                if stats is not None:
+                    stats.stop_reason = STOP_DEADLINE
+                raise RuntimeError('solver timed out')
+
+        if budget is not None and budget.spend(pop_count):
+            # out of budget, so stop with the best state found so far
+            stop_reason = STOP_BUDGET
+            break
 
         if not thorough:
             # stop after checking too many states
             state_count += 1
             if state_count > 100 * level.width * level.height:
+                stop_reason = STOP_STATE_LIMIT
                 break
 
             # don't search states that have too many more remaining switches than the best seen so far
             if len(current.switches) < min_switches:
                 min_switches = len(current.switches)
             elif len(current.switches) > min_switches + 1:
+                if stats is not None:
+                    stats.pruned_switches += 1
                 continue
 
         if current.didwin:
             best_state_guess = 1.0
-            best_state_tup = current_tup
+            best_node = current_node
+            stop_reason = STOP_GOAL
             break
 
+        # skip states that were dominated after being pushed
+        dominated = False
+        for front_stamina, front_cost in key_front[node_key[current_node] >> staminabits]:
+            if front_stamina > current.stamina and front_cost <= node_cost[current_node]:
+                dominated = True
+                break
+        if dominated:
+            if stats is not None:
+                stats.dominated += 1
+            continue
+
+        if stats is not None:
+            stats.expanded += 1
+
+        if explored is not None:
+            # cells whose tiles the expansion can depend on are next to these
+            explored.add(current.player)
+            explored.update(current.enemies)
+
         actions_available = ACTIONS
         if slow and current.enemymv:
             actions_available = [' ']
 
-        for action in actions_available:
-            nbr = Game.step(level, current, action)
-            nbr_tup = nbr.totuple()
+        new_cost = node_cost[current_node] + 1
+        if cost_bound is not None and new_cost >= cost_bound:
+            # can't lead to a shorter solution than one already found
+            continue
 
-            new_cost = cost_so_far[current_tup] + 1
-            if nbr_tup not in cost_so_far or new_cost < cost_so_far[nbr_tup]:
-                cost_so_far[nbr_tup] = new_cost
+        for action in actions_available:
+            nbr = step(level, current, action)
+            nbr_key = codec.encode(nbr)
+
+            nbr_node = key_node.get(nbr_key)
+            if nbr_node is None or new_cost < node_cost[nbr_node]:
+                nbr_rest = nbr_key >> staminabits
+                nbr_stamina = nbr_key & staminamask
+                front = key_front.get(nbr_rest)
+                if front is None:
+                    key_front[nbr_rest] = [(nbr_stamina, new_cost)]
+                else:
+                    dominated = False
+                    for front_stamina, front_cost in front:
+                        if front_stamina > nbr_stamina and front_cost <= new_cost:
+                            dominated = True
+                            break
+                    if dominated:
+                        if stats is not None:
+                            stats.dominated += 1
+                        continue
+                    front = [(front_stamina, front_cost) for front_stamina, front_cost in front if front_stamina > nbr_stamina or front_cost < new_cost]
+                    front.append((nbr_stamina, new_cost))
+                    key_front[nbr_rest] = front
+
+                if nbr_node is None:
+                    nbr_node = len(node_key)
+                    key_node[nbr_key] = nbr_node
+                    node_key.append(nbr_key)
+                    node_parent.append(current_node)
+                    node_action.append(ACTIONS.index(action))
+                    node_cost.append(new_cost)
+                else:
+                    node_parent[nbr_node] = current_node
+                    node_action[nbr_node] = ACTIONS.index(action)
+                    node_cost[nbr_node] = new_cost
 
-                priority = new_cost + heur(level, nbr)
+                estimate = heuristic(level, nbr)
+                if bound_heuristic and cost_bound is not None and new_cost + estimate >= cost_bound:
+                    continue
+                priority = new_cost + weight * estimate
 
                 guess = compl_guess(level, nbr)
                 if guess > best_state_guess:
                     best_state_guess = guess
-                    best_state_tup = nbr_tup
+                    best_node = nbr_node
+
+                # states the heuristic rules out are only kept for the best guess
+                if priority != math.inf:
+                    frontier.push(priority, codec.order(nbr_key, nbr.enemymv), nbr_node, new_cost)
+                    if stats is not None:
+                        stats.pushed += 1
+
+            elif stats is not None:
+                stats.duplicates += 1
 
-                heapq.heappush(frontier, (priority, nbr_tup, nbr))
-                came_from[nbr_tup] = (action, current_tup)
+    if stats is not None:
+        stats.stop_reason = stop_reason
+        stats.nodes = len(node_key)
+        reconstruct_start_time = time.perf_counter()
 
     actions = []
     path = []
 
-    path_found = State.fromtuple(best_state_tup).didwin
+    path_found = State.fromkey(codec, node_key[best_node]).didwin
 
-    current_tup = best_state_tup
-    while current_tup is not None:
-        path.append(State.fromtuple(current_tup))
-        action, current_tup = came_from[current_tup]
-        actions.append(action)
+    current_node = best_node
+    while current_node != -1:
+        path.append(node_key[current_node])
+        actions.append(ACTIONS[node_action[current_node]])
+        current_node = node_parent[current_node]
     actions.reverse()
     actions = actions[1:]
     path.reverse()
 
-    # debug check
-    chk_state = state.clone()
-    for ii in range(len(actions)):
-        chk_state = Game.step(level, chk_state, actions[ii])
-        if chk_state.totuple() != path[ii+1].totuple():
-            raise RuntimeError('actions do not follow path')
+    if _solver_verify >= VERIFY_SEARCH:
+        chk_state = state.clone()
+        for ii in range(len(actions)):
+            chk_state = Game.step(level, chk_state, actions[ii])
+            if chk_state.tokey(codec) != path[ii+1]:
+                raise RuntimeError('actions do not follow path')
+
+        if chk_state.tokey(codec) != node_key[best_node]:
+            raise RuntimeError('actions do not lead to ending state')
+
+        if path_found and not chk_state.didwin:
+            raise RuntimeError('actions do not lead to winning state but should')
+
+        if not path_found and chk_state.didwin:
+            raise RuntimeError('actions lead to winning state but should not')
 
-    if chk_state.totuple() != best_state_tup:
-        raise RuntimeError('actions do not lead to ending state')
+    if trajectory is not None:
+        # the path's states are already known, so nothing needs to be replayed
+        trajectory.record(codec.decode(key) for key in path)
+
+    if stats is not None:
+        stats.time_reconstruct += time.perf_counter() - reconstruct_start_time
+        stats.time_total += time.perf_counter() - solve_start_time
+
+    return path_found, actions
+
+
+
+
+def dosolve_anytime(level, state, slow, budget, heuristic=heur, stats=None, frontier=FRONTIER_HEAP, trajectory=None):
+    # weighted A* with decreasing weights until the budget runs out, keeping the shortest
+    # solution found, or the actions reaching the best guess state if there is no solution yet
+    best_solved = False
+    best_actions = []
+    best_guess = compl_guess(level, state)
+    best_trajectory = Trajectory()
+    best_trajectory.record([state])
+
+    for weight in ANYTIME_WEIGHTS:
+        if budget.exhausted():
+            break
+
+        search_stats = SolveStats()
+        search_trajectory = Trajectory()
+        cost_bound = len(best_actions) if best_solved else None
+        solved, actions = dosolve(level, state, True, slow, None, heuristic, search_stats, weight, budget, cost_bound, None, frontier, search_trajectory)
+
+        if stats is not None:
+            for attr, value in vars(search_stats).items():
+                if attr == 'stop_reason':
+                    stats.stop_reason = value
+                elif attr == 'peak_frontier':
+                    stats.peak_frontier = max(stats.peak_frontier, value)
+                else:
+                    setattr(stats, attr, getattr(stats, attr) + value)
+
+        if solved:
+            if not best_solved or len(actions) < len(best_actions):
+                best_solved, best_actions, best_trajectory = True, actions, search_trajectory
+        elif not best_solved:
+            end_state = state.clone()
+            for action in actions:
+                end_state = Game.step(level, end_state, action)
+            if compl_guess(level, end_state) > best_guess:
+                best_guess, best_actions, best_trajectory = compl_guess(level, end_state), actions, search_trajectory
+
+        if search_stats.stop_reason == STOP_EXHAUSTED and not solved:
+            # the whole reachable space was searched without finding a solution, or one shorter than the cost bound,
+            # so the best solution so far is optimal and lower weights can't improve on it
+            break
+
+    if trajectory is not None:
+        vars(trajectory).update(vars(best_trajectory))
+
+    return best_solved, best_actions
+
+
+
+def segment_windows(width, segment_width, overlap):
+    # overlapping [start, end) column ranges covering the level
+    assert overlap < segment_width
+    windows = []
+    col_lo = 0
+    while True:
+        col_hi = min(width, col_lo + segment_width)
+        windows.append((col_lo, col_hi))
+        if col_hi == width:
+            return windows
+        col_lo = col_hi - overlap
+
+def dosolve_segmented(level, state, thorough, slow, segment_width, heuristic=heur, stats=None, deadline=None, frontier=FRONTIER_HEAP, trajectory=None):
+    # solve overlapping column windows from left to right: each window searches from the boundary states
+    # the previous window reached until the player gets into the next window with every switch to its
+    # left hit, and the action sequences are stitched together
+    start = state.clone()
+    codec = StateCodec(level, start, slow or len(start.enemies) > 0)
+
+    if level.compiled is None:
+        level.compiled = CompiledLevel(level)
+
+    if start.exit in start.enemies:
+            raise RuntimeError('enemy starts on exit')
+    if start.exit in level.spikes:
+            raise RuntimeError('spike on exit')
+
+    windows = segment_windows(level.width, segment_width, max(1, segment_width // 4))
+
+    if start.exit[1] < windows[-1][0]:
+        # the windows only move right, so getting back to an exit left of the last window can need the whole level
+        return dosolve(level, state, thorough, slow, deadline, heuristic, stats, frontier=frontier, trajectory=trajectory)
+
+    starts = [(start, [])]
+    best_state_guess = compl_guess(level, start)
+    best_actions = []
+    path_found = start.didwin
+    pop_count = 0
+
+    for window_index, (col_lo, col_hi) in enumerate(windows):
+        last = window_index + 1 == len(windows)
+        goal_col = None if last else windows[window_index + 1][0]
+        required = [] if last else [switch for switch in start.switches if switch[1] < goal_col]
+
+        # like heur, but heading for the next window once this window's switches are hit
+        def window_heur(level, state):
+            if last:
+                return heuristic(level, state)
+            remaining = [switch for switch in required if switch in state.switches]
+            if len(remaining) == 0:
+                return -state.stamina + max(0, goal_col - state.player[1])
+            closest_dist_sqr = min((state.player[0] - switch[0])**2 + (state.player[1] - switch[1])**2 for switch in remaining)
+            return -state.stamina + closest_dist_sqr**0.5 + len(remaining) * (segment_width + level.height)
+
+        def at_goal(state):
+            if last:
+                return False
+            return not state.didlose and state.player[1] >= goal_col and not any(switch in state.switches for switch in required)
+
+        # node arena as in dosolve, with roots pointing back at the start they came from
+        node_key = []
+        node_parent = array.array('i')
+        node_action = bytearray()
+        node_cost = array.array('i')
+        node_start = array.array('i')
+        key_node = {}
+        window_frontier = make_frontier(frontier)
+
+        for start_index, (start_state, _) in enumerate(starts):
+            start_key = codec.encode(start_state)
+            if start_key in key_node:
+                continue
+            key_node[start_key] = len(node_key)
+            node_key.append(start_key)
+            node_parent.append(-1)
+            node_action.append(0)
+            node_cost.append(0)
+            node_start.append(start_index)
+            # as in dosolve, states the heuristic rules out are not searched from
+            priority = window_heur(level, start_state)
+            if priority != math.inf:
+                window_frontier.push(priority, codec.order(start_key, start_state.enemymv), len(node_key) - 1, 0)
+
+        def actions_to(node):
+            actions = []
+            while node_parent[node] != -1:
+                actions.append(ACTIONS[node_action[node]])
+                node = node_parent[node]
+            actions.reverse()
+            return starts[node_start[node]][1] + actions
+
+        goals = []
+        won_node = None
+        state_count = 0
+        min_switches = len(start.switches)
+        window_best_guess = best_state_guess
+        window_best_node = None
+
+        while len(window_frontier) > 0:
+            if stats is not None:
+                stats.popped += 1
+                stats.peak_frontier = max(stats.peak_frontier, len(window_frontier))
+
+            current_node, current_cost = window_frontier.pop()
+            if current_cost > node_cost[current_node]:
+                if stats is not None:
+                    stats.stale += 1
+                continue
+
+            current = codec.decode(node_key[current_node])
+
+            pop_count += 1
+            if deadline is not None and pop_count % 1024 == 0 and time.time() > deadline:
+                if stats is not None:
+                    stats.stop_reason = STOP_DEADLINE
+                raise RuntimeError('solver timed out')
+
+            # stop after checking too many states in this window
+            state_count += 1
+            if state_count > 100 * (col_hi - col_lo) * level.height:
+                break
+
+            if not thorough:
+                # don't search states that have too many more remaining switches than the best seen so far
+                if len(current.switches) < min_switches:
+                    min_switches = len(current.switches)
+                elif len(current.switches) > min_switches + 1:
+                    if stats is not None:
+                        stats.pruned_switches += 1
+                    continue
+
+            if current.didwin:
+                # windows overlap, so the exit can be reached before the last window
+                won_node = current_node
+                break
+
+            if at_goal(current):
+                goals.append(current_node)
+                if len(goals) >= SEGMENT_BEAM:
+                    break
+                continue
+
+            if current.didlose:
+                continue
+
+            if stats is not None:
+                stats.expanded += 1
+
+            actions_available = ACTIONS
+            if slow and current.enemymv:
+                actions_available = [' ']
+
+            new_cost = node_cost[current_node] + 1
+
+            for action in actions_available:
+                nbr = Game.stepfast(level, current, action)
+                if nbr.player[1] < col_lo or nbr.player[1] >= col_hi:
+                    continue
+                nbr_key = codec.encode(nbr)
+
+                nbr_node = key_node.get(nbr_key)
+                if nbr_node is None or new_cost < node_cost[nbr_node]:
+                    if nbr_node is None:
+                        nbr_node = len(node_key)
+                        key_node[nbr_key] = nbr_node
+                        node_key.append(nbr_key)
+                        node_parent.append(current_node)
+                        node_action.append(ACTIONS.index(action))
+                        node_cost.append(new_cost)
+                        node_start.append(-1)
+                    else:
+                        node_parent[nbr_node] = current_node
+                        node_action[nbr_node] = ACTIONS.index(action)
+                        node_cost[nbr_node] = new_cost
+
+                    guess = compl_guess(level, nbr)
+                    if guess > window_best_guess:
+                        window_best_guess = guess
+                        window_best_node = nbr_node
+
+                    priority = new_cost + window_heur(level, nbr)
+                    if priority != math.inf:
+                        window_frontier.push(priority, codec.order(nbr_key, nbr.enemymv), nbr_node, new_cost)
+                        if stats is not None:
+                            stats.pushed += 1
+
+        if stats is not None:
+            stats.nodes += len(node_key)
+
+        if window_best_node is not None:
+            best_state_guess = window_best_guess
+            best_actions = actions_to(window_best_node)
+
+        if won_node is not None:
+            path_found = True
+            best_actions = actions_to(won_node)
+            if stats is not None:
+                stats.stop_reason = STOP_GOAL
+            break
+
+        if len(goals) == 0:
+            if stats is not None:
+                stats.stop_reason = STOP_EXHAUSTED
+            break
+
+        starts = [(codec.decode(node_key[goal]), actions_to(goal)) for goal in goals]
+
+    # the windows' actions are stitched together, so they are always checked
+    chk_states = replay_states(level, state, best_actions)
+    chk_state = chk_states[-1]
 
     if path_found and not chk_state.didwin:
         raise RuntimeError('actions do not lead to winning state but should')
@@ -520,8 +1707,349 @@ def dosolve(level, state, thorough, slow):
     if not path_found and chk_state.didwin:
         raise RuntimeError('actions lead to winning state but should not')
 
-    return path_found, actions
+    if trajectory is not None:
+        trajectory.record(chk_states)
+
+    return path_found, best_actions
+
+
+
+class ParallelSearch:
+    # what the processes of a parallel search share; they are forked, so the level and heuristic aren't pickled
+    def __init__(self, level, codec, slow, heuristic, workers, deadline):
+        context = multiprocessing.get_context('fork')
+
+        self.level = level
+        self.codec = codec
+        self.slow = slow
+        self.heuristic = heuristic
+        self.admissible = getattr(heuristic, 'admissible', False)
+        self.workers = workers
+        self.deadline = deadline
+
+        self.inboxes = [context.Queue() for _ in range(workers)]
+        self.results = context.Queue()
+
+        # in_flight counts batches sent but not yet received, and idle the workers with nothing left to expand;
+        # both change under lock, so when all workers are idle and nothing is in flight the search is over
+        self.lock = context.Lock()
+        self.in_flight = context.Value('q', 0, lock=False)
+        self.idle = context.Value('i', 0, lock=False)
+        self.done = context.Value('b', 0, lock=False)
+        self.stop = context.Value('b', 0, lock=False)
+        self.incumbent = context.Value('d', math.inf, lock=False)
+
+        self.processes = [context.Process(target=parallel_worker, args=(self, index), daemon=True) for index in range(workers)]
+
+    def owner(self, key):
+        # states that differ only in stamina have the same owner, so each worker can check dominance on its own
+        return ((hash(key >> self.codec.staminabits) * 0x9E3779B97F4A7C15) >> 40) % self.workers
+
+    def send(self, owner, batch):
+        with self.lock:
+            self.in_flight.value += 1
+        self.inboxes[owner].put(('states', batch))
+
+def parallel_worker(search, index):
+    # expands the states search.owner assigns to index, then answers path queries until told to quit
+    for inbox in search.inboxes:
+        inbox.cancel_join_thread()
+
+    inbox = search.inboxes[index]
+    parent = {}
+
+    try:
+        parallel_expand(search, index, parent)
+    except RuntimeError as e:
+        with search.lock:
+            search.stop.value = 1
+        search.results.put(('error', str(e)))
+        search.results.put(('finished', index, 0.0, None, {}))
 
+    while True:
+        msg = inbox.get()
+        if msg[0] == 'parent':
+            search.results.put(('parent', msg[1], parent[msg[1]]))
+        elif msg[0] == 'quit':
+            return
+
+def parallel_expand(search, index, parent):
+    level, codec, heuristic = search.level, search.codec, search.heuristic
+    admissible = search.admissible
+    incumbent = search.incumbent
+    inbox = search.inboxes[index]
+    step = Game.stepfast
+
+    staminabits = codec.staminabits
+    staminamask = codec.staminamask
+
+    node_cost = {}
+    key_front = {}
+    open_list = []
+    sequence = 0
+    outboxes = [[] for _ in range(search.workers)]
+    counts = { 'popped': 0, 'expanded': 0, 'pushed': 0, 'duplicates': 0, 'dominated': 0, 'stale': 0 }
+
+    best_state_guess = 0.0
+    best_key = None
+    idle = False
+
+    def accept(key, cost, parent_key, action):
+        # the same checks dosolve makes on a neighbor, made by the state's owner
+        nonlocal sequence, best_state_guess, best_key
+
+        old_cost = node_cost.get(key)
+        if old_cost is not None and cost >= old_cost:
+            counts['duplicates'] += 1
+            return
+
+        rest = key >> staminabits
+        stamina = key & staminamask
+        front = key_front.get(rest)
+        if front is None:
+            key_front[rest] = [(stamina, cost)]
+        else:
+            for front_stamina, front_cost in front:
+                if front_stamina > stamina and front_cost <= cost:
+                    counts['dominated'] += 1
+                    return
+            front = [(front_stamina, front_cost) for front_stamina, front_cost in front if front_stamina > stamina or front_cost < cost]
+            front.append((stamina, cost))
+            key_front[rest] = front
+
+        node_cost[key] = cost
+        parent[key] = (parent_key, action)
+
+        state = codec.decode(key)
+        estimate = heuristic(level, state)
+        if admissible and cost + estimate >= incumbent.value:
+            return
+
+        guess = compl_guess(level, state)
+        if guess > best_state_guess:
+            best_state_guess = guess
+            best_key = key
+
+        priority = cost + estimate
+        if priority != math.inf:
+            heapq.heappush(open_list, (priority, sequence, key, cost))
+            sequence += 1
+            counts['pushed'] += 1
+
+    def flush():
+        for owner, outbox in enumerate(outboxes):
+            if len(outbox) > 0:
+                search.send(owner, outbox)
+                outboxes[owner] = []
+
+    while not search.done.value and not search.stop.value:
+        # take in states from other workers, blocking briefly when there is nothing else to do
+        while True:
+            try:
+                msg = inbox.get(timeout=0.01) if idle else inbox.get_nowait()
+            except queue.Empty:
+                break
+            with search.lock:
+                if idle:
+                    search.idle.value -= 1
+                    idle = False
+                search.in_flight.value -= 1
+            for item in msg[1]:
+                accept(*item)
+
+        if idle:
+            continue
+
+        for _ in range(PARALLEL_EXPAND):
+            if len(open_list) == 0:
+                break
+
+            if admissible and open_list[0][0] >= incumbent.value:
+                # nothing left here can lead to a cheaper solution
+                open_list.clear()
+                break
+
+            _, _, current_key, current_cost = heapq.heappop(open_list)
+            if current_cost > node_cost[current_key]:
+                counts['stale'] += 1
+                continue
+
+            counts['popped'] += 1
+            if search.deadline is not None and counts['popped'] % 1024 == 0 and time.time() > search.deadline:
+                with search.lock:
+                    search.stop.value = 1
+                search.results.put(('timeout',))
+                break
+
+            current = codec.decode(current_key)
+
+            if current.didwin:
+                with search.lock:
+                    if current_cost < incumbent.value:
+                        incumbent.value = current_cost
+                        search.results.put(('goal', current_cost, current_key))
+                    # without an admissible heuristic, the first solution is taken as dosolve does
+                    if not admissible:
+                        search.stop.value = 1
+                continue
+
+            dominated = False
+            for front_stamina, front_cost in key_front[current_key >> staminabits]:
+                if front_stamina > current.stamina and front_cost <= current_cost:
+                    dominated = True
+                    break
+            if dominated:
+                counts['dominated'] += 1
+                continue
+
+            counts['expanded'] += 1
+
+            actions_available = ACTIONS
+            if search.slow and current.enemymv:
+                actions_available = [' ']
+
+            new_cost = current_cost + 1
+            if admissible and new_cost >= incumbent.value:
+                continue
+
+            for action in actions_available:
+                nbr_key = codec.encode(step(level, current, action))
+                owner = search.owner(nbr_key)
+                if owner == index:
+                    accept(nbr_key, new_cost, current_key, ACTIONS.index(action))
+                else:
+                    outboxes[owner].append((nbr_key, new_cost, current_key, ACTIONS.index(action)))
+                    if len(outboxes[owner]) >= PARALLEL_BATCH:
+                        search.send(owner, outboxes[owner])
+                        outboxes[owner] = []
+
+        flush()
+
+        if len(open_list) == 0:
+            with search.lock:
+                search.idle.value += 1
+                idle = True
+                if search.idle.value == search.workers and search.in_flight.value == 0:
+                    search.done.value = 1
+
+    counts['nodes'] = len(node_cost)
+    search.results.put(('finished', index, best_state_guess, best_key, counts))
+
+def dosolve_parallel(level, state, slow, workers, deadline=None, heuristic=heur, stats=None, trajectory=None):
+    # a thorough search spread over worker processes as in HDA*: each state belongs to the worker its key hashes
+    # to, which keeps its own open and closed sets, and states for other workers are sent to them in batches;
+    # with an admissible heuristic the search continues until no worker can find a cheaper solution, so the
+    # solution found is as short as dosolve's
+    start = state.clone()
+    codec = StateCodec(level, start, slow or len(start.enemies) > 0)
+
+    if level.compiled is None:
+        level.compiled = CompiledLevel(level)
+    start_key = codec.encode(start)
+
+    if start.exit in start.enemies:
+            raise RuntimeError('enemy starts on exit')
+    if start.exit in level.spikes:
+            raise RuntimeError('spike on exit')
+
+    if stats is not None:
+        solve_start_time = time.perf_counter()
+
+    # the start is in flight before any worker can find everything idle
+    search = ParallelSearch(level, codec, slow, heuristic, workers, deadline)
+    search.send(search.owner(start_key), [(start_key, 0, None, 0)])
+    for process in search.processes:
+        process.start()
+
+    try:
+        goal_cost, goal_key = math.inf, None
+        best_state_guess, best_key = 0.0, None
+        errors = []
+        timed_out = False
+        finished = set()
+        while len(finished) < workers:
+            try:
+                msg = search.results.get(timeout=0.1)
+            except queue.Empty:
+                if deadline is not None and not timed_out and time.time() > deadline:
+                    with search.lock:
+                        search.stop.value = 1
+                    timed_out = True
+                for index, process in enumerate(search.processes):
+                    if index not in finished and not process.is_alive():
+                        raise RuntimeError('search worker exited')
+                continue
+
+            if msg[0] == 'goal':
+                if msg[1] < goal_cost:
+                    goal_cost, goal_key = msg[1], msg[2]
+            elif msg[0] == 'timeout':
+                timed_out = True
+            elif msg[0] == 'error':
+                errors.append(msg[1])
+            elif msg[0] == 'finished':
+                _, index, guess, key, counts = msg
+                finished.add(index)
+                if key is not None and guess > best_state_guess:
+                    best_state_guess, best_key = guess, key
+                if stats is not None:
+                    for attr, value in counts.items():
+                        setattr(stats, attr, getattr(stats, attr) + value)
+
+        if len(errors) > 0:
+            raise RuntimeError(errors[0])
+
+        if timed_out:
+            if stats is not None:
+                stats.stop_reason = STOP_DEADLINE
+            raise RuntimeError('solver timed out')
+
+        path_found = goal_key is not None
+        end_key = goal_key
+        if not path_found:
+            end_key = best_key if best_key is not None else start_key
+
+        # each state's parent is kept by its owner
+        path = [end_key]
+        actions = []
+        while path[-1] != start_key:
+            search.inboxes[search.owner(path[-1])].put(('parent', path[-1]))
+            msg = search.results.get()
+            parent_key, action = msg[2]
+            path.append(parent_key)
+            actions.append(ACTIONS[action])
+        path.reverse()
+        actions.reverse()
+
+    finally:
+        for inbox in search.inboxes:
+            inbox.put(('quit',))
+        for process in search.processes:
+            process.join(1.0)
+            if process.is_alive():
+                process.terminate()
+
+    if _solver_verify >= VERIFY_SEARCH:
+        chk_state = state.clone()
+        for ii in range(len(actions)):
+            chk_state = Game.step(level, chk_state, actions[ii])
+            if chk_state.tokey(codec) != path[ii+1]:
+                raise RuntimeError('actions do not follow path')
+
+        if path_found and not chk_state.didwin:
+            raise RuntimeError('actions do not lead to winning state but should')
+
+        if not path_found and chk_state.didwin:
+            raise RuntimeError('actions lead to winning state but should not')
+
+    if trajectory is not None:
+        trajectory.record(codec.decode(key) for key in path)
+
+    if stats is not None:
+        stats.stop_reason = STOP_GOAL if path_found else STOP_EXHAUSTED
+        stats.time_total += time.perf_counter() - solve_start_time
+
+    return path_found, actions
 
 
 
@@ -569,14 +2097,190 @@ def play(levelfile, is_file, partial):
 
 
 
-def solve_and_run(levelfile, is_file, partial, thorough, flaw, display_states, display_solution):
-    g = Game()
-    g.loadself(levelfile, is_file, partial)
+def solve_and_run(levelfile, is_file, partial, thorough, flaw, display_states, display_solution, timeout=None, use_cache=True, heuristic=HEURISTIC_EUCLID, stats=None, budget_ms=None, budget_nodes=None, segment=None, warm=False, frontier=FRONTIER_HEAP, render=RENDER_FULL, export=None, workers=None, playability_only=False):
+    deadline = None
+    if timeout is not None:
+        deadline = time.time() + timeout
+
+    if is_file:
+        rows = Game.readrows(levelfile)
+    else:
+        rows = list(levelfile)
+
+    if warm:
+        level, state = get_warm_level(rows, partial)
+    else:
+        g = Game()
+        g.loadself(rows, False, partial)
+        level, state = g.level, g.state
+
+    # budgeted solves depend on timing, so they are not cached
+    if budget_ms is not None or budget_nodes is not None:
+        use_cache = False
+
+    cache, cache_key, cached = None, None, None
+    if use_cache:
+        cache = get_solve_cache()
+        options = { 'heuristic': heuristic, 'segment': segment, 'frontier': frontier }
+        if use_parallel(level, thorough, workers):
+            # ties between solutions can be broken differently by a parallel search
+            options['parallel'] = True
+        if playability_only:
+            # these results can come from a shortcut with a different path and stamina
+            options['playability_only'] = True
+        cache_key = SolveCache.key(rows, partial, thorough, flaw, options)
+        cached = cache.get(cache_key)
+
+    if cached is not None:
+        if stats is not None:
+            stats.stop_reason = STOP_CACHED
+        if not display_states and not display_solution and export is None:
+            didwin, best_switches, best_cols, positions, stamina = cached['run']
+            return didwin, level, best_switches, best_cols, [tuple(position) for position in positions], stamina
+        solved, actions = cached['solved'], cached['actions']
+        trajectory = None
+    else:
+        trajectory = Trajectory()
+        solved, actions = solve_for_run(level, state.clone(), thorough, flaw, deadline, heuristic, stats, budget_ms, budget_nodes, segment, frontier, trajectory=trajectory, workers=workers, playability_only=playability_only)
+
+    result = run(level, state.clone(), actions, solved, display_states, display_solution, trajectory, render, export)
+
+    if cache is not None and cached is None:
+        didwin, _, best_switches, best_cols, positions, stamina = result
+        cache.put(cache_key, { 'solved': solved, 'actions': actions, 'run': [didwin, best_switches, best_cols, positions, stamina] })
+
+    return result
+
+def solve_for_run(level, state, thorough, flaw, deadline=None, heuristic=HEURISTIC_EUCLID, stats=None, budget_ms=None, budget_nodes=None, segment=None, frontier=FRONTIER_HEAP, cost_bound=None, distance_fields=None, trajectory=None, workers=None, playability_only=False):
+    if heuristic not in HEURISTICS:
+        raise RuntimeError('unrecognized heuristic')
+
+    if frontier not in FRONTIERS:
+        raise RuntimeError('unrecognized frontier')
+
+    level, solve_start, reachable, slow = solve_setup(level, state, flaw)
+
+    # the search can leave out enemies that never meet the player, which doesn't change the actions found
+    level, solve_start = drop_irrelevant_enemies(level, solve_start, reachable)
+
+    heuristic_fn = heur
+    if heuristic == HEURISTIC_DISTANCE:
+        heuristic_fn = DistanceHeuristic(level, solve_start, reachable, distance_fields)
+
+    if segment is not None and segment < 2:
+        raise RuntimeError('segment must be at least 2 columns')
+
+    if segment is not None and (budget_ms is not None or budget_nodes is not None):
+        raise RuntimeError('segmented solving does not support a budget')
+
+    # the solver's trajectory is also the real level's when it plans from the real start, without hidden tiles or a
+    # moved exit or removed switches
+    record = None
+    if trajectory is not None and flaw not in FLAW_REMOVES and solve_start.exit == state.exit and len(solve_start.switches) == len(state.switches):
+        record = trajectory
+
+    solved, actions = None, None
+
+    if playability_only and segment is None and budget_ms is None and budget_nodes is None and len(solve_start.enemies) == 0 and len(solve_start.food) > 0:
+        # without enemies, food only adds stamina, so a solution found without any food still wins; this search is
+        # limited by the starting stamina, and if it doesn't win the full search is needed; its path and stamina can
+        # differ from the full search's, so it's only used when the caller just wants playability
+        nofood_start = solve_start.clone()
+        nofood_start.food = []
+        solved, actions = dosolve(level, nofood_start, thorough, slow, deadline, heuristic_fn, stats, cost_bound=cost_bound, frontier=frontier)
+        if solved:
+            states = replay_states(level, solve_start, actions)
+            if states[-1].didwin:
+                if record is not None:
+                    record.record(states)
+            else:
+                solved = None
+
+    if not solved:
+        if segment is not None and level.width > segment:
+            solved, actions = dosolve_segmented(level, solve_start, thorough, slow, segment, heuristic_fn, stats, deadline, frontier, record)
+        elif budget_ms is not None or budget_nodes is not None:
+            solved, actions = dosolve_anytime(level, solve_start, slow, SolveBudget(budget_ms, budget_nodes), heuristic_fn, stats, frontier, record)
+        elif use_parallel(level, thorough, workers) and cost_bound is None:
+            solved, actions = dosolve_parallel(level, solve_start, slow, workers, deadline, heuristic_fn, stats, record)
+        else:
+            solved, actions = dosolve(level, solve_start, thorough, slow, deadline, heuristic_fn, stats, cost_bound=cost_bound, frontier=frontier, trajectory=record)
+
+    return solved, actions
 
-    solved, actions = solve_for_run(g.level, g.state.clone(), thorough, flaw)
-    return run(g.level, g.state.clone(), actions, solved, display_states, display_solution)
+def use_parallel(level, thorough, workers):
+    # small levels are solved faster than worker processes can be started
+    if workers is None or workers <= 1 or not thorough:
+        return False
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        return False
+    return level.width * level.height >= PARALLEL_MIN_CELLS
+
+def drop_irrelevant_enemies(level, state, reachable):
+    # returns a level and state without the enemies that can never share a cell with the player, or with another
+    # enemy that can, since those never affect the player
+    compiled = level.compiled
+
+    regions = []
+    for enemy in state.enemies:
+        region = set()
+        processing = [compiled.cell(enemy)]
+        while len(processing) > 0:
+            curr = processing.pop()
+            if curr in region:
+                continue
+            region.add(curr)
+            for action in ACTIONS:
+                nbr = compiled.enemyneighbors[action][curr]
+                if nbr >= 0:
+                    processing.append(nbr)
+        regions.append(region)
+
+    touched = set(compiled.cell(rc) for rc in reachable)
+    relevant = set()
+    changed = True
+    while changed:
+        changed = False
+        for ii, region in enumerate(regions):
+            if ii not in relevant and not region.isdisjoint(touched):
+                relevant.add(ii)
+                touched |= region
+                changed = True
+
+    if len(relevant) == len(regions):
+        return level, state
+
+    keep = sorted(relevant)
+
+    search_level = Level()
+    search_level.width = level.width
+    search_level.height = level.height
+    search_level.switchcount = level.switchcount
+    search_level.blocks = level.blocks
+    search_level.spikes = level.spikes
+    search_level.enemyst = [level.enemyst[ii] for ii in keep]
+    search_level.compiled = CompiledLevel(search_level)
+
+    search_state = state.clone()
+    search_state.enemies = [state.enemies[ii] for ii in keep]
+
+    return search_level, search_state
+
+def replay_states(level, state, actions):
+    # the states from following actions, up to a step that wins or loses
+    states = [state.clone()]
+    for action in actions:
+        if states[-1].didwin or states[-1].didlose:
+            break
+        states.append(Game.step(level, states[-1], action))
+    return states
+
+def replay_wins(level, state, actions):
+    return replay_states(level, state, actions)[-1].didwin
 
-def solve_for_run(level, state, thorough, flaw):
+def solve_setup(level, state, flaw):
+    # the level the solver plans on and the state it starts from, with the exit moved and switches removed if
+    # they can't be reached
     if flaw not in FLAWS:
         raise RuntimeError('unrecognized flaw')
 
@@ -584,11 +2288,11 @@ def solve_for_run(level, state, thorough, flaw):
     if flaw == FLAW_NO_SPEED:
         slow = True
 
+    # the solver doesn't see some tiles, so its plan is run on the real level and may lose there
+    if flaw in FLAW_REMOVES:
+        level, state = derive_variant(level, state, FLAW_REMOVES[flaw])
+
     solve_start = state.clone()
-    if flaw == FLAW_NO_SPIKE:
-        raise RuntimeError('flaw not currently supported')
-    elif flaw == FLAW_NO_HAZARD:
-        raise RuntimeError('flaw not currently supported')
 
     # determine reachable tiles
     processing = []
@@ -622,51 +2326,181 @@ def solve_for_run(level, state, thorough, flaw):
             reachable_switches.append(switch)
     solve_start.switches = reachable_switches
 
-    return dosolve(level, solve_start, thorough, slow)
+    if level.compiled is None:
+        level.compiled = CompiledLevel(level)
+
+    return level, solve_start, reachable, slow
+
+def derive_variant(level, state, remove):
+    # the level and state with the tiles in remove taken out, sharing whatever doesn't change
+    for char in remove:
+        if char not in VARIANT_CHARS:
+            raise RuntimeError(f'can not remove tile: {char}')
+
+    variant_level = Level()
+    variant_level.width = level.width
+    variant_level.height = level.height
+    variant_level.switchcount = level.switchcount
+    variant_level.blocks = level.blocks
+    variant_level.spikes = level.spikes
+    variant_level.enemyst = level.enemyst
+    variant_level.compiled = level.compiled
+
+    variant_state = state.clone()
+
+    if CHAR_SPIKE in remove and len(level.spikes) > 0:
+        variant_level.spikes = set()
+        variant_level.compiled = None
+    if CHAR_ENEMY in remove and len(level.enemyst) > 0:
+        variant_level.enemyst = []
+        variant_state.enemies = []
+        variant_level.compiled = None
+    if CHAR_SWITCH in remove:
+        variant_level.switchcount = 0
+        variant_state.switches = []
+    if CHAR_FOOD in remove:
+        variant_state.food = []
+
+    if variant_level.compiled is None:
+        variant_level.compiled = CompiledLevel(variant_level)
+
+    return variant_level, variant_state
+
+def is_relaxation(level_a, start_a, level_b, start_b):
+    # whether every solution from start_b also solves start_a: a has no enemies, and no tile of a gets in the way
+    # of a move that b allows
+    return (len(start_a.enemies) == 0 and start_a.player == start_b.player and start_a.exit == start_b.exit and
+            start_a.stamina == start_b.stamina and start_a.didwin == start_b.didwin and
+            level_a.blocks <= level_b.blocks and level_a.spikes <= level_b.spikes and
+            set(start_a.switches) <= set(start_b.switches) and set(start_a.food) >= set(start_b.food))
+
+def solve_variants(levelfile, is_file, partial, thorough, flaw, variants, timeout=None, use_cache=True, heuristic=HEURISTIC_EUCLID):
+    # solves the level once for each variant, given as the tiles it removes such as ['', '#^', '#^*'], loading the
+    # level once and sharing distance fields; returns what solve_and_run would for each variant
+    if is_file:
+        rows = Game.readrows(levelfile)
+    else:
+        rows = list(levelfile)
 
-def run(level, state, actions, should_solve, display_states, display_solution):
-    positions = [state.player]
-    best_switches = 0
-    best_cols = 0
+    level, state = Game.load(rows, False, partial)
 
-    dsp_state = state.clone()
+    # a thorough search with an admissible heuristic finds a shortest solution, so a relaxation's solution is a
+    # lower bound on a harder variant's, and a harder variant's solution is an upper bound on a relaxation's
+    use_bounds = thorough and flaw == FLAW_NO_FLAW and heuristic == HEURISTIC_DISTANCE
 
-    if display_states:
-        Game.display(level, dsp_state)
+    cache = get_solve_cache() if use_cache else None
+    distance_fields = {}
+    planned = []
+    results = []
 
-    current_switches = level.switchcount - len(dsp_state.switches)
-    best_switches = max(best_switches, current_switches)
-    current_cols = dsp_state.player[1] + 1
-    best_cols = max(best_cols, current_cols)
+    for remove in variants:
+        variant_level, variant_state = derive_variant(level, state, remove)
 
-    for action in actions:
-        dsp_state = Game.step(level, dsp_state, action)
-        positions.append(dsp_state.player)
+        if use_bounds:
+            plan_level, plan_start, _, _ = solve_setup(variant_level, variant_state, flaw)
+
+        cache_key, cached = None, None
+        if cache is not None:
+            table = str.maketrans({ char: CHAR_BLANK for char in remove })
+            cache_key = SolveCache.key([row.translate(table) for row in rows], partial, thorough, flaw, { 'heuristic': heuristic, 'segment': None, 'frontier': FRONTIER_HEAP })
+            cached = cache.get(cache_key)
+
+        if cached is not None:
+            if use_bounds:
+                planned.append((plan_level, plan_start, cached['solved'], cached['actions']))
+            didwin, best_switches, best_cols, positions, stamina = cached['run']
+            results.append((didwin, variant_level, best_switches, best_cols, [tuple(position) for position in positions], stamina))
+            continue
 
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+
+        # results the bounds decide can differ from a plain solve's in the path taken, so they aren't cached under
+        # the plain solve's key
+        solved, actions, cost_bound = None, None, None
+        bounded = False
+        if use_bounds:
+            for other_level, other_start, other_solved, other_actions in planned:
+                if not other_solved:
+                    continue
+                if is_relaxation(other_level, other_start, plan_level, plan_start):
+                    # a shortest solution of the relaxation that still wins is a shortest solution here
+                    if replay_wins(plan_level, plan_start, other_actions):
+                        solved, actions = True, other_actions
+                        bounded = True
+                        break
+                elif is_relaxation(plan_level, plan_start, other_level, other_start):
+                    if cost_bound is None or len(other_actions) + 1 < cost_bound:
+                        cost_bound = len(other_actions) + 1
+
+        trajectory = None
+        if solved is None:
+            trajectory = Trajectory()
+            solved, actions = solve_for_run(variant_level, variant_state.clone(), thorough, flaw, deadline, heuristic, cost_bound=cost_bound, distance_fields=distance_fields, trajectory=trajectory)
+            bounded = cost_bound is not None
+            if not solved and cost_bound is not None:
+                trajectory = Trajectory()
+                solved, actions = solve_for_run(variant_level, variant_state.clone(), thorough, flaw, deadline, heuristic, distance_fields=distance_fields, trajectory=trajectory)
+                bounded = False
+
+        if use_bounds:
+            planned.append((plan_level, plan_start, solved, actions))
+
+        result = run(variant_level, variant_state.clone(), actions, solved, False, False, trajectory)
+
+        if cache is not None and not bounded:
+            didwin, _, best_switches, best_cols, positions, stamina = result
+            cache.put(cache_key, { 'solved': solved, 'actions': actions, 'run': [didwin, best_switches, best_cols, positions, stamina] })
+
+        results.append(result)
+
+    return results
+
+def run(level, state, actions, should_solve, display_states, display_solution, trajectory=None, render=RENDER_FULL, export=None):
+    # uses the solver's trajectory for the actions when there is one, rather than replaying them; export is a file to
+    # write an animation of the actions to
+    recorded = trajectory is not None and trajectory.recorded()
+
+    if display_states or export is not None or not recorded or _solver_verify >= VERIFY_RUN:
+        dsp_state = state.clone()
+        states = [dsp_state]
+
+        renderer = None
         if display_states:
-            print(action)
-            Game.display(level, dsp_state)
+            renderer = Renderer(level, render)
+            renderer.show(dsp_state)
 
-        if dsp_state.didlose:
-            break
+        for action in actions:
+            if dsp_state.didwin or dsp_state.didlose:
+                break
 
-        current_switches = level.switchcount - len(dsp_state.switches)
-        best_switches = max(best_switches, current_switches)
-        current_cols = dsp_state.player[1] + 1
-        best_cols = max(best_cols, current_cols)
+            dsp_state = Game.step(level, dsp_state, action)
+            states.append(dsp_state)
 
-        if dsp_state.didwin:
-            break
+            if renderer is not None:
+                renderer.show(dsp_state, action)
+
+        if export is not None:
+            write_animation(export, level, states, actions[:len(states) - 1])
+
+        replayed = Trajectory()
+        replayed.record(states)
+        if recorded and replayed.totuple() != trajectory.totuple():
+            raise RuntimeError('actions do not follow trajectory')
+        trajectory = replayed
+
+    best_switches, best_cols = trajectory.best(level)
 
-    if not should_solve and dsp_state.didwin:
+    if not should_solve and trajectory.didwin:
         raise RuntimeError('no path found but still won')
 
     if display_solution:
         if not should_solve:
             print('No path found!')
-        elif dsp_state.didlose:
+        elif trajectory.didlose:
             print('Lost!')
-        elif dsp_state.didwin:
+        elif trajectory.didwin:
             print('Won!')
         else:
             print('Didn\'t win or lose!')
@@ -674,44 +2508,544 @@ def run(level, state, actions, should_solve, display_states, display_solution):
         print('Best switches: %d / %d.' % (best_switches, level.switchcount))
         print('Best column: %d / %d.' % (best_cols, level.width))
 
-    return dsp_state.didwin, level, best_switches, best_cols, positions, dsp_state.stamina
+    return trajectory.didwin, level, best_switches, best_cols, list(trajectory.positions), trajectory.stamina[-1]
 
-def percent_playable(levelfile, is_file, partial, thorough, flaw):
-    didwin, level, best_switches, best_cols, _, _ = solve_and_run(levelfile, is_file, partial, thorough, flaw, False, False)
+def percent_playable(levelfile, is_file, partial, thorough, flaw, timeout=None, use_cache=True, heuristic=HEURISTIC_EUCLID, stats=None, budget_ms=None, budget_nodes=None, segment=None, frontier=FRONTIER_HEAP, workers=None):
+    didwin, level, best_switches, best_cols, _, _ = solve_and_run(levelfile, is_file, partial, thorough, flaw, False, False, timeout, use_cache, heuristic, stats, budget_ms, budget_nodes, segment, False, frontier, workers=workers, playability_only=True)
 
     if didwin:
         return 1.0
 
     return completion(level, best_switches, best_cols)
 
+def _percent_playable_or_none(args):
+    try:
+        return percent_playable(*args)
+    except RuntimeError:
+        return None
+
+def percent_playable_many(levelfiles, is_file, partial, thorough, flaw, workers=None, chunksize=1, timeout=None, use_cache=True, heuristic=HEURISTIC_EUCLID, budget_ms=None, budget_nodes=None, segment=None, frontier=FRONTIER_HEAP):
+    # results are in the same order as levelfiles, with None for levels that raised an error or timed out
+    jobs = [(levelfile, is_file, partial, thorough, flaw, timeout, use_cache, heuristic, None, budget_ms, budget_nodes, segment, frontier) for levelfile in levelfiles]
+
+    if workers == 1:
+        return [_percent_playable_or_none(job) for job in jobs]
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(_percent_playable_or_none, jobs, chunksize=chunksize))
+
+class SolveSession:
+    # a level loaded once and rescored after tile edits, reusing the previous result where the edits can't change it
+    def __init__(self, rows, partial, thorough, flaw, heuristic=HEURISTIC_EUCLID):
+        if heuristic not in HEURISTICS:
+            raise RuntimeError('unrecognized heuristic')
+
+        self.rows = [list(row) for row in rows]
+        self.partial = partial
+        self.thorough = thorough
+        self.flaw = flaw
+        self.heuristic = heuristic
+
+        # columns are given in the unpadded rows, but the level is padded for partial levels
+        self.col_offset = 2 if partial else 0
+
+        self.level = None
+        self.state = None
+        self.solve_start = None
+        self.reachable = None
+        self.heuristic_fn = None
+        self.explored = None
+        self.solved = None
+        self.actions = None
+        self.result = None
+        self.edits = []
+
+        # how the last result was found: unchanged, replay, outside, or search
+        self.reuse = None
+        self.searches = 0
+
+    def tile(self, rr, cc):
+        return self.rows[rr][cc]
+
+    def edit(self, rr, cc, char):
+        if self.rows[rr][cc] == char:
+            return
+        self.rows[rr][cc] = char
+        self.edits.append((rr, cc + self.col_offset))
+
+    def percent_playable(self, timeout=None):
+        didwin, level, best_switches, best_cols = self.solve(timeout)[:4]
+        if didwin:
+            return 1.0
+        return completion(level, best_switches, best_cols)
+
+    def solve(self, timeout=None):
+        # returns the same values as run
+        if self.result is not None and len(self.edits) == 0:
+            self.reuse = 'unchanged'
+            return self.result
+
+        level, state = Game.load([''.join(row) for row in self.rows], False, self.partial)
+        plan_level, solve_start, reachable, slow = solve_setup(level, state, self.flaw)
+
+        edits = self.edits
+        self.edits = []
+
+        same_start = self.result is not None and SolveSession.same_start(solve_start, self.solve_start)
+
+        heuristic_fn = heur
+        if self.heuristic == HEURISTIC_DISTANCE:
+            # distance fields only depend on the reachable cells, switches and exit
+            if same_start and reachable == self.reachable:
+                heuristic_fn = self.heuristic_fn
+            else:
+                heuristic_fn = DistanceHeuristic(plan_level, solve_start, reachable)
+
+        # with flaws that hide tiles, a plan that still wins isn't what the flawed solver would find
+        if self.result is not None and self.result[0] and self.flaw not in FLAW_REMOVES:
+            # a solution that still wins when replayed is still a solution, though not one a search would have
+            # found, so the explored cells can't be used after this
+            try:
+                result = run(level, state.clone(), self.actions, True, False, False)
+            except RuntimeError:
+                result = None
+            if result is not None and result[0]:
+                self.reuse = 'replay'
+                self.update(level, state, solve_start, reachable, heuristic_fn, None, True, self.actions, result)
+                return result
+
+        same_heuristic = self.heuristic == HEURISTIC_EUCLID or heuristic_fn is self.heuristic_fn
+        if self.explored is not None and same_start and same_heuristic and level.width == self.level.width and level.height == self.level.height:
+            # the search only depends on tiles at or next to the player and enemies in the states it expanded
+            if not any(SolveSession.near(self.explored, edit) for edit in edits):
+                result = run(level, state.clone(), self.actions, self.solved, False, False)
+                self.reuse = 'outside'
+                self.update(level, state, solve_start, reachable, heuristic_fn, self.explored, self.solved, self.actions, result)
+                return result
+
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+
+        explored = set()
+        solved, actions = dosolve(plan_level, solve_start, self.thorough, slow, deadline, heuristic_fn, explored=explored)
+        result = run(level, state.clone(), actions, solved, False, False)
+        self.reuse = 'search'
+        self.searches += 1
+        self.update(level, state, solve_start, reachable, heuristic_fn, explored, solved, actions, result)
+        return result
+
+    def update(self, level, state, solve_start, reachable, heuristic_fn, explored, solved, actions, result):
+        self.level, self.state = level, state
+        self.solve_start, self.reachable = solve_start, reachable
+        self.heuristic_fn = heuristic_fn
+        self.explored = explored
+        self.solved, self.actions = solved, actions
+        self.result = result
+
+    @staticmethod
+    def same_start(state_a, state_b):
+        return (state_a.player == state_b.player and state_a.exit == state_b.exit and state_a.enemies == state_b.enemies and
+                state_a.switches == state_b.switches and state_a.food == state_b.food and state_a.didwin == state_b.didwin)
+
+    @staticmethod
+    def near(cells, rc):
+        for dr, dc in [(0, 0), (-1, 0), (1, 0), (0, -1), (0, 1)]:
+            if (rc[0] + dr, rc[1] + dc) in cells:
+                return True
+        return False
+
+_warm_levels = {}
+
+def get_warm_level(rows, partial):
+    # the parsed and compiled level is shared between solves, so the state must be cloned before use
+    level_key = (tuple(rows), bool(partial))
+    loaded = _warm_levels.get(level_key)
+    if loaded is None:
+        if len(_warm_levels) >= SERVE_LEVEL_CACHE_SIZE:
+            _warm_levels.clear()
+        loaded = Game.load(rows, False, partial)
+        _warm_levels[level_key] = loaded
+    return loaded
+
+def check_request(request):
+    # why a request can't be solved, or None; checked before it goes to a worker, so a bad field can't take one down
+    rows = request.get('rows')
+    if rows is None:
+        return "missing 'rows'"
+    if not isinstance(rows, list) or len(rows) == 0 or not all(isinstance(row, str) for row in rows):
+        return 'rows must be a list of strings'
+    if any(len(row) != len(rows[0]) for row in rows):
+        return 'rows not all same length'
+
+    for name in ['partial', 'thorough', 'cache']:
+        if not isinstance(request.get(name, False), bool):
+            return name + ' must be true or false'
+
+    for name, allowed in [('flaw', FLAWS), ('heuristic', HEURISTICS), ('frontier', FRONTIERS)]:
+        if name in request and request[name] not in allowed:
+            return 'unrecognized ' + name
+
+    for name, kinds, minimum in [('timeout', (int, float), 0), ('budget_ms', (int, float), 0), ('budget_nodes', int, 0), ('segment', int, 2)]:
+        value = request.get(name)
+        if value is None:
+            continue
+        if isinstance(value, bool) or not isinstance(value, kinds):
+            return name + (' must be an integer' if kinds is int else ' must be a number')
+        if value < minimum:
+            return '%s must be at least %d' % (name, minimum)
+
+    return None
+
+def serve_request(request):
+    response = { 'id': request.get('id') }
+    error = check_request(request)
+    if error is not None:
+        response['error'] = error
+        return response
+    try:
+        stats = SolveStats()
+        start_time = time.perf_counter()
+        didwin, level, best_switches, best_cols, _, _ = solve_and_run(request['rows'], False, request.get('partial', False), request.get('thorough', False), request.get('flaw', FLAW_NO_FLAW), False, False,
+                                                                      request.get('timeout'), request.get('cache', True), request.get('heuristic', HEURISTIC_EUCLID), stats,
+                                                                      request.get('budget_ms'), request.get('budget_nodes'), request.get('segment'), True, request.get('frontier', FRONTIER_HEAP), playability_only=True)
+        response['playability'] = 1.0 if didwin else completion(level, best_switches, best_cols)
+        response['time'] = time.perf_counter() - start_time
+        response['stats'] = vars(stats)
+    except KeyError as e:
+        response['error'] = 'missing ' + str(e)
+    except (RuntimeError, TypeError, ValueError) as e:
+        response['error'] = str(e)
+    except sqlite3.Error as e:
+        response['error'] = 'cache error: ' + str(e)
+    return response
+
+class SolveServer:
+    # solves json line requests on a pool of worker processes, writing each response as soon as it's done
+    def __init__(self, workers=None):
+        self.workers = workers
+        self.executor = None
+        self.executor_lock = threading.Lock()
+        if workers != 1:
+            self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+
+    def serve_lines(self, lines, write):
+        lock = threading.Lock()
+        def respond(response):
+            with lock:
+                write(json.dumps(response) + '\n')
+
+        # set once each response is written, which can be after its future counts as done
+        written = []
+        for line in lines:
+            if line.strip() == '':
+                continue
+
+            try:
+                request = json.loads(line)
+            except ValueError as e:
+                respond({ 'id': None, 'error': 'bad request: ' + str(e) })
+                continue
+            if not isinstance(request, dict):
+                respond({ 'id': None, 'error': 'bad request: not an object' })
+                continue
+
+            error = check_request(request)
+            if error is not None:
+                respond({ 'id': request.get('id'), 'error': error })
+                continue
+
+            if self.executor is None:
+                respond(serve_request(request))
+            else:
+                event = threading.Event()
+                def finish(response, event=event):
+                    respond(response)
+                    event.set()
+                self.submit(request, finish)
+                written.append(event)
+
+        for event in written:
+            event.wait()
+
+    def submit(self, request, finish):
+        # a worker that dies breaks the whole pool, failing every request it holds, so the pool is replaced and
+        # those requests are solved again each on their own, where only the one that killed a worker fails
+        with self.executor_lock:
+            executor = self.executor
+            try:
+                future = executor.submit(serve_request, request)
+            except concurrent.futures.process.BrokenProcessPool:
+                executor = self.replace_executor(executor)
+                future = executor.submit(serve_request, request)
+
+        def done(future):
+            if isinstance(future.exception(), concurrent.futures.process.BrokenProcessPool):
+                with self.executor_lock:
+                    self.replace_executor(executor)
+                SolveServer.submit_alone(request, finish)
+            else:
+                finish(SolveServer.future_response(future, request))
+        future.add_done_callback(done)
+
+    def replace_executor(self, broken):
+        # called holding executor_lock; the pool may already have been replaced for another of its requests
+        if self.executor is broken:
+            broken.shutdown(wait=False)
+            self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.workers)
+        return self.executor
+
+    @staticmethod
+    def submit_alone(request, finish):
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=1)
+        executor.submit(serve_request, request).add_done_callback(lambda future: finish(SolveServer.future_response(future, request)))
+        executor.shutdown(wait=False)
+
+    @staticmethod
+    def future_response(future, request):
+        try:
+            return future.result()
+        except Exception as e:
+            # the worker process died
+            return { 'id': request.get('id'), 'error': 'worker failed: ' + str(e) }
+
+    def serve_stdio(self):
+        def write(text):
+            sys.stdout.write(text)
+            sys.stdout.flush()
+        self.serve_lines(sys.stdin, write)
+
+    def serve_socket(self, path):
+        solver = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                def write(text):
+                    self.wfile.write(text.encode())
+                    self.wfile.flush()
+                solver.serve_lines((line.decode() for line in self.rfile), write)
+
+        if os.path.exists(path):
+            if not stat.S_ISSOCK(os.stat(path).st_mode):
+                raise RuntimeError('socket path exists and is not a socket')
+            os.unlink(path)
+
+        with socketserver.ThreadingUnixStreamServer(path, Handler) as server:
+            try:
+                server.serve_forever()
+            finally:
+                os.unlink(path)
+
+def write_corpus(path, sources):
+    # packs (name, rows) pairs, such as from load_level_sources, into a corpus file; returns the number of levels
+    entries = []
+    names = bytearray()
+
+    with open(path, 'wb') as corpus_file:
+        corpus_file.write(CORPUS_HEADER.pack(CORPUS_MAGIC, 0, 0))
+
+        for name, rows in sources:
+            width = len(rows[0]) if len(rows) > 0 else 0
+            for row in rows:
+                if len(row) != width:
+                    raise RuntimeError('rows not all same length')
+            if len(rows) > 0xffff or width > 0xffff:
+                raise RuntimeError('level too large for corpus')
+
+            try:
+                tiles = ''.join(rows).encode('ascii')
+            except UnicodeEncodeError:
+                raise RuntimeError('level has non-ascii tiles')
+
+            name_bytes = str(name).encode()
+            entries.append((corpus_file.tell(), len(names), len(name_bytes), len(rows), width))
+            names += name_bytes
+            corpus_file.write(tiles)
+
+        names_offset = corpus_file.tell()
+        corpus_file.write(names)
+
+        index_offset = corpus_file.tell()
+        for tiles_offset, name_offset, name_length, height, width in entries:
+            corpus_file.write(CORPUS_ENTRY.pack(tiles_offset, names_offset + name_offset, name_length, height, width))
+
+        corpus_file.seek(0)
+        corpus_file.write(CORPUS_HEADER.pack(CORPUS_MAGIC, len(entries), index_offset))
+
+    return len(entries)
+
+class CorpusReader:
+    # memory-maps a corpus file, so levels are only read and decoded when asked for
+    def __init__(self, path):
+        self.corpus_file = open(path, 'rb')
+        if os.fstat(self.corpus_file.fileno()).st_size < CORPUS_HEADER.size:
+            self.corpus_file.close()
+            raise RuntimeError('not a level corpus')
+
+        self.data = mmap.mmap(self.corpus_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count, self.index_offset = CORPUS_HEADER.unpack_from(self.data, 0)
+        if magic != CORPUS_MAGIC:
+            self.close()
+            raise RuntimeError('not a level corpus')
+
+    def close(self):
+        self.data.close()
+        self.corpus_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return self.count
+
+    def entry(self, index):
+        if index < 0 or index >= self.count:
+            raise IndexError('corpus index out of range')
+        return CORPUS_ENTRY.unpack_from(self.data, self.index_offset + index * CORPUS_ENTRY.size)
+
+    def name(self, index):
+        _, name_offset, name_length, _, _ = self.entry(index)
+        return self.data[name_offset:name_offset + name_length].decode()
+
+    def tiles(self, index):
+        # the rows joined together, with the level's width and height
+        tiles_offset, _, _, height, width = self.entry(index)
+        return self.data[tiles_offset:tiles_offset + height * width].decode('ascii'), width, height
+
+    def rows(self, index):
+        tiles, width, height = self.tiles(index)
+        return [tiles[rr * width:(rr + 1) * width] for rr in range(height)]
+
+    def load(self, index, partial):
+        if partial:
+            return Game.load(self.rows(index), False, True)
+        return Game.loadtiles(*self.tiles(index))
+
+    def __iter__(self):
+        for index in range(self.count):
+            yield self.name(index), self.rows(index)
+
+    def levels(self, partial):
+        for index in range(self.count):
+            yield self.load(index, partial)
+
+def load_level_sources(path):
+    # yields (name, rows) for a level file, a directory of level files, a json file of name -> rows, or a corpus file
+    if os.path.isdir(path):
+        for filename in sorted(os.listdir(path)):
+            if filename.endswith('.txt'):
+                yield os.path.join(path, filename), Game.readrows(os.path.join(path, filename))
+
+    elif path.endswith('.json'):
+        with open(path) as json_file:
+            data = json.load(json_file)
+        if isinstance(data, dict):
+            for name, rows in data.items():
+                yield name, rows
+        else:
+            for ii, rows in enumerate(data):
+                yield str(ii), rows
+
+    elif path.endswith('.dgc'):
+        with CorpusReader(path) as corpus:
+            yield from corpus
+
+    else:
+        yield path, Game.readrows(path)
+
 def get_path(levelfile, is_file, partial, thorough, flaw):
-    didwin, _, _, _, positions = solve_and_run(levelfile, is_file, partial, thorough, flaw, False, False)
+    didwin, _, _, _, positions, _ = solve_and_run(levelfile, is_file, partial, thorough, flaw, False, False)
     return didwin, positions
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='DungeonGrams game.')
-    parser.add_argument('levelfile', type=str,help='Input level file.')
+    parser.add_argument('levelfile', type=str,help='Input level file; for --serve, - for stdin or a Unix socket path.')
     parser.add_argument('--play', action='store_true', help='Play level.')
     parser.add_argument('--partial', action='store_true', help='Add player and exit to partial level.')
     parser.add_argument('--solve', action='store_true', help='Solve level.')
     parser.add_argument('--playability', action='store_true', help='Calculate level playability value.')
+    parser.add_argument('--serve', action='store_true', help='Answer playability requests given as json lines.')
+    parser.add_argument('--pack', type=str, help='Pack the levels in levelfile (as for --batch) into this .dgc corpus file.', default=None)
     parser.add_argument('--thorough', action='store_true', help='Perform a more thorough, but slower, search for a solution.')
     parser.add_argument('--hidestates', action='store_true', help='Hide any solver states that would be displayed.')
+    parser.add_argument('--render', type=str, help='How --solve displays states: ' + (', '.join(RENDERS)) + ' (redraw only changes with ANSI escapes).', default=RENDER_FULL)
+    parser.add_argument('--export', type=str, help='Write the --solve solution to this file instead of displaying states: an asciicast animation for .cast, otherwise text frames.', default=None)
     parser.add_argument('--flaw', type=str, help='Flaw for solver: ' + (', '.join(FLAWS)) + '.', default=FLAW_NO_FLAW)
+    parser.add_argument('--heuristic', type=str, help='Heuristic for solver: ' + (', '.join(HEURISTICS)) + '.', default=HEURISTIC_EUCLID)
+    parser.add_argument('--frontier', type=str, help='Frontier for solver: ' + (', '.join(FRONTIERS)) + '.', default=FRONTIER_HEAP)
+    parser.add_argument('--batch', action='store_true', help='Treat levelfile as a directory of level files or a json file of levels.')
+    parser.add_argument('--workers', type=int, help='Number of worker processes for --batch or --serve, or for a --thorough search of a single large level.', default=None)
+    parser.add_argument('--chunksize', type=int, help='Number of levels sent to a worker at a time for --batch.', default=1)
+    parser.add_argument('--timeout', type=float, help='Time limit in seconds for solving each level.', default=None)
+    parser.add_argument('--nocache', action='store_true', help='Do not read or write the solver result cache.')
+    parser.add_argument('--budget-ms', type=float, help='Anytime solve: improve the solution until this many milliseconds have passed.', default=None)
+    parser.add_argument('--budget-nodes', type=int, help='Anytime solve: improve the solution until this many states have been checked.', default=None)
+    parser.add_argument('--segment', type=int, help='Solve levels wider than this many columns in overlapping windows of this width.', default=None)
+    parser.add_argument('--stats', action='store_true', help='Print solver search statistics to stderr.')
+    parser.add_argument('--verify', type=int, help='Check solver output by replaying it: 0 not at all, 1 the trajectory used for results, 2 also every search path.', default=VERIFY_NONE)
     args = parser.parse_args()
 
-    if int(args.play) + int(args.solve) + int(args.playability) != 1:
-        raise RuntimeError('exactly one of --play, --solve, --playability must be given')
+    if int(args.play) + int(args.solve) + int(args.playability) + int(args.serve) + int(args.pack is not None) != 1:
+        raise RuntimeError('exactly one of --play, --solve, --playability, --serve, --pack must be given')
 
     if args.thorough and not (args.solve or args.playability):
         raise RuntimeError('--thorough only works with  --solve or --playability')
 
+    if (args.export is not None or args.render != RENDER_FULL) and not args.solve:
+        raise RuntimeError('--export and --render only work with --solve')
+
+    if args.batch and not args.playability:
+        raise RuntimeError('--batch only works with --playability')
+
+    if args.segment is not None and args.segment < 2:
+        raise RuntimeError('--segment must be at least 2')
+
+    if args.stats and not (args.solve or args.playability) or args.stats and args.batch:
+        raise RuntimeError('--stats only works with --solve or --playability on a single level')
+
+    stats = SolveStats() if args.stats else None
+
+    set_solver_verify(args.verify)
+
     if args.play:
         play(args.levelfile, True, args.partial)
 
     elif args.solve:
-        solve_and_run(args.levelfile, True, args.partial, args.thorough, args.flaw, not args.hidestates, True)
+        solve_and_run(args.levelfile, True, args.partial, args.thorough, args.flaw, not args.hidestates and args.export is None, True, args.timeout, not args.nocache, args.heuristic, stats, args.budget_ms, args.budget_nodes, args.segment, frontier=args.frontier, render=args.render, export=args.export, workers=args.workers)
+
+    elif args.playability and args.batch:
+        names, levels = [], []
+        for name, rows in load_level_sources(args.levelfile):
+            names.append(name)
+            levels.append(rows)
+
+        playabilities = percent_playable_many(levels, False, args.partial, args.thorough, args.flaw, args.workers, args.chunksize, args.timeout, not args.nocache, args.heuristic, args.budget_ms, args.budget_nodes, args.segment, args.frontier)
+        for name, playability in zip(names, playabilities):
+            print('%s\t%s' % (name, playability))
+
+    elif args.pack is not None:
+        print('packed %d levels into %s' % (write_corpus(args.pack, load_level_sources(args.levelfile)), args.pack))
+
+    elif args.serve:
+        server = SolveServer(args.workers)
+        try:
+            if args.levelfile == '-':
+                server.serve_stdio()
+            else:
+                server.serve_socket(args.levelfile)
+        finally:
+            server.close()
 
     elif args.playability:
-        print(percent_playable(args.levelfile, True, args.partial, args.thorough, args.flaw))
+        print(percent_playable(args.levelfile, True, args.partial, args.thorough, args.flaw, args.timeout, not args.nocache, args.heuristic, stats, args.budget_ms, args.budget_nodes, args.segment, args.frontier, args.workers))
+
+    if stats is not None:
+        pprint.pprint(vars(stats), sys.stderr)
 
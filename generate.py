@@ -0,0 +1,263 @@
+from collections import Counter
+from typing import Dict, Iterator, List, Optional, Tuple
+import argparse
+import concurrent.futures
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+import dungeongrams
+
+'''
+Column-slice n-gram level generator.
+
+  python generate.py train --output model.npz
+  python generate.py sample model.npz --count 1000 --output generated.json
+  python generate.py sample model.npz --count 100 --min-playability 1.0 --output playable.json
+
+Generated levels are strips like the partial training levels, written with a player and exit added as by
+Game.padpartial, so the output is a json file of name -> rows like difficulty/output.json.
+'''
+
+DEFAULT_SOURCES = ['train', 'other_training_levels', os.path.join('levels', 'full')]
+
+# the player and exit are added to generated strips, so they are left out of the columns
+STRIP_CHARS = {
+    dungeongrams.CHAR_PLAYER_PLAYING: dungeongrams.CHAR_BLANK,
+    dungeongrams.CHAR_EXIT_OPEN: dungeongrams.CHAR_BLANK,
+    dungeongrams.CHAR_EXIT_CLOSED: dungeongrams.CHAR_BLANK,
+}
+
+SAMPLE_BATCH = 1024
+
+class NGramModel:
+    # columns are ids into vocab, a (columns, height) array of tile bytes; context ii is the n - 1 columns
+    # contexts[ii], and its continuations are entries offsets[ii] to offsets[ii + 1] of next_column, next_context
+    # and counts; start_contexts and start_counts are the contexts levels begin with
+    def __init__(self, n: int, vocab: np.ndarray, contexts: np.ndarray, offsets: np.ndarray, next_column: np.ndarray, next_context: np.ndarray, counts: np.ndarray, start_contexts: np.ndarray, start_counts: np.ndarray):
+        self.n = n
+        self.vocab = vocab
+        self.contexts = contexts
+        self.offsets = offsets
+        self.next_column = next_column
+        self.next_context = next_context
+        self.counts = counts
+        self.start_contexts = start_contexts
+        self.start_counts = start_counts
+
+        # sampling picks an entry by where a random count falls in the running total
+        self.cumulative = np.cumsum(counts)
+        self.base = np.concatenate([[0], self.cumulative])[offsets[:-1]]
+        self.totals = self.cumulative[offsets[1:] - 1] - self.base
+        self.start_cumulative = np.cumsum(start_counts)
+
+    @property
+    def height(self) -> int:
+        return self.vocab.shape[1]
+
+    def save(self, path: str) -> None:
+        np.savez_compressed(path, n=self.n, vocab=self.vocab, contexts=self.contexts, offsets=self.offsets, next_column=self.next_column,
+                            next_context=self.next_context, counts=self.counts, start_contexts=self.start_contexts, start_counts=self.start_counts)
+
+    @staticmethod
+    def load(path: str) -> 'NGramModel':
+        with np.load(path) as data:
+            return NGramModel(int(data['n']), data['vocab'], data['contexts'], data['offsets'], data['next_column'],
+                              data['next_context'], data['counts'], data['start_contexts'], data['start_counts'])
+
+    def sample(self, count: int, width: int, rng: np.random.Generator) -> np.ndarray:
+        # column ids of count strips of width columns, indexed [strip, column]
+        columns = np.zeros((count, width), dtype=np.int32)
+
+        starts = np.searchsorted(self.start_cumulative, rng.integers(0, self.start_cumulative[-1], count), side='right')
+        context = self.start_contexts[starts]
+        prefix = min(width, self.n - 1)
+        columns[:, :prefix] = self.contexts[context, :prefix]
+
+        for cc in range(prefix, width):
+            picks = self.base[context] + (rng.random(count) * self.totals[context]).astype(np.int64)
+            entries = np.searchsorted(self.cumulative, picks, side='right')
+            columns[:, cc] = self.next_column[entries]
+            context = self.next_context[entries]
+
+        return columns
+
+    def rows(self, columns: np.ndarray) -> List[List[str]]:
+        # the strips as rows of tiles
+        tiles = self.vocab[columns].transpose(0, 2, 1)
+        width = columns.shape[1]
+        return [[text[ii:ii + width] for ii in range(0, len(text), width)] for text in (strip.tobytes().decode('ascii') for strip in tiles)]
+
+def level_columns(rows: List[str]) -> List[str]:
+    rows = [row.translate(str.maketrans(STRIP_CHARS)) for row in rows]
+    return [''.join(row[cc] for row in rows) for cc in range(len(rows[0]))]
+
+def train(sources: List[str], n: int, height: int) -> NGramModel:
+    # counts how often each column follows each n - 1 columns; a context seen without a continuation, such as the
+    # end of a level, backs off to the continuations of its longest suffix that has some
+    if n < 1:
+        raise RuntimeError('n must be at least 1')
+
+    vocab_index = {}
+    levels = []
+    for source in sources:
+        for name, rows in dungeongrams.load_level_sources(source):
+            if len(rows) != height:
+                sys.stderr.write('skipping %s: height %d, not %d\n' % (name, len(rows), height))
+                continue
+            levels.append([vocab_index.setdefault(column, len(vocab_index)) for column in level_columns(rows)])
+
+    if len(levels) == 0:
+        raise RuntimeError('no training levels of height %d' % height)
+
+    # suffix_counts[k] maps k columns to counts of the column after them
+    suffix_counts = [{} for _ in range(n)]
+    start_counts = Counter()
+    for level in levels:
+        if len(level) >= n - 1:
+            start_counts[tuple(level[:n - 1])] += 1
+        for cc in range(len(level)):
+            for kk in range(min(cc, n - 1) + 1):
+                suffix_counts[kk].setdefault(tuple(level[cc - kk:cc]), Counter())[level[cc]] += 1
+
+    def continuations(context: Tuple[int, ...]) -> Counter:
+        for kk in range(n - 1, -1, -1):
+            counter = suffix_counts[kk].get(context[len(context) - kk:])
+            if counter:
+                return counter
+        raise RuntimeError('no continuations')
+
+    # every context that sampling can reach, starting from the ones levels begin with
+    context_index = {}
+    pending = list(start_counts)
+    for context in pending:
+        context_index.setdefault(context, len(context_index))
+    context_list = list(context_index)
+    entries = []
+    while len(pending) > 0:
+        context = pending.pop()
+        for column, column_count in continuations(context).items():
+            next_context = (context + (column,))[1:] if n > 1 else ()
+            if next_context not in context_index:
+                context_index[next_context] = len(context_index)
+                context_list.append(next_context)
+                pending.append(next_context)
+            entries.append((context_index[context], column, context_index[next_context], column_count))
+    entries.sort()
+
+    contexts = np.array(context_list, dtype=np.int32).reshape(len(context_list), n - 1)
+    entry_array = np.array(entries, dtype=np.int64).reshape(len(entries), 4)
+    offsets = np.searchsorted(entry_array[:, 0], np.arange(len(context_list) + 1)).astype(np.int64)
+
+    vocab = np.frombuffer(''.join(vocab_index).encode('ascii'), dtype=np.uint8).reshape(len(vocab_index), height)
+
+    return NGramModel(n, vocab, contexts, offsets, entry_array[:, 1].astype(np.int32), entry_array[:, 2].astype(np.int32), entry_array[:, 3].astype(np.int32),
+                      np.array([context_index[context] for context in start_counts], dtype=np.int32), np.array(list(start_counts.values()), dtype=np.int64))
+
+def generate(model: NGramModel, count: int, width: int, seed: Optional[int] = None) -> Iterator[List[str]]:
+    # full levels, with a player and exit added to each strip
+    rng = np.random.default_rng(seed)
+    while count > 0:
+        batch = min(count, SAMPLE_BATCH)
+        for rows in model.rows(model.sample(batch, width, rng)):
+            yield dungeongrams.Game.padpartial(rows)
+        count -= batch
+
+def _playability(item: Tuple[List[str], bool, str, Optional[float]]) -> Optional[float]:
+    rows, thorough, flaw, timeout = item
+    try:
+        return dungeongrams.percent_playable(rows, False, False, thorough, flaw, timeout, False)
+    except RuntimeError:
+        return None
+
+def generate_playable(model: NGramModel, count: int, width: int, min_playability: float, seed: Optional[int] = None, thorough: bool = False,
+                      flaw: str = dungeongrams.FLAW_NO_FLAW, timeout: Optional[float] = None, workers: Optional[int] = None, max_tries: Optional[int] = None) -> Iterator[List[str]]:
+    # levels from generate whose playability is at least min_playability, scored by a pool of workers while more
+    # are generated; gives up after max_tries levels have been scored
+    candidates = generate(model, max_tries if max_tries is not None else sys.maxsize, width, seed)
+    found = 0
+
+    if workers == 1:
+        for rows in candidates:
+            playability = _playability((rows, thorough, flaw, timeout))
+            if playability is not None and playability >= min_playability:
+                yield rows
+                found += 1
+                if found == count:
+                    return
+        return
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        # keep a bounded number of levels in flight, kept in the order they were generated
+        max_in_flight = 4 * (workers or os.cpu_count() or 1)
+        in_flight = []
+        for rows in candidates:
+            in_flight.append((rows, executor.submit(_playability, (rows, thorough, flaw, timeout))))
+            while len(in_flight) >= max_in_flight or (len(in_flight) > 0 and in_flight[0][1].done()):
+                rows, future = in_flight.pop(0)
+                playability = future.result()
+                if playability is not None and playability >= min_playability:
+                    yield rows
+                    found += 1
+                    if found == count:
+                        for _, future in in_flight:
+                            future.cancel()
+                        return
+        for rows, future in in_flight:
+            playability = future.result()
+            if playability is not None and playability >= min_playability:
+                yield rows
+                found += 1
+                if found == count:
+                    return
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='DungeonGrams column n-gram level generator.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    train_parser = subparsers.add_parser('train', help='Train a model.')
+    train_parser.add_argument('sources', type=str, nargs='*', default=DEFAULT_SOURCES, help='Level sources: directories of level files, json files of levels, .dgc corpus files, or level files.')
+    train_parser.add_argument('--n', type=int, default=3, help='Number of columns in each n-gram.')
+    train_parser.add_argument('--height', type=int, default=11, help='Level height; levels of other heights are skipped.')
+    train_parser.add_argument('--output', type=str, default='model.npz', help='Output model file.')
+
+    sample_parser = subparsers.add_parser('sample', help='Generate levels from a model.')
+    sample_parser.add_argument('model', type=str, help='Model file from train.')
+    sample_parser.add_argument('--count', type=int, default=1000, help='Number of levels to generate.')
+    sample_parser.add_argument('--width', type=int, default=15, help='Columns in each level before the player and exit are added.')
+    sample_parser.add_argument('--seed', type=int, default=None, help='Random seed.')
+    sample_parser.add_argument('--min-playability', type=float, default=None, help='Only keep levels with at least this playability.')
+    sample_parser.add_argument('--max-tries', type=int, default=None, help='With --min-playability, give up after scoring this many levels.')
+    sample_parser.add_argument('--thorough', action='store_true', help='With --min-playability, use a thorough search.')
+    sample_parser.add_argument('--flaw', type=str, default=dungeongrams.FLAW_NO_FLAW, help='With --min-playability, flaw for solver: ' + (', '.join(dungeongrams.FLAWS)) + '.')
+    sample_parser.add_argument('--timeout', type=float, default=None, help='With --min-playability, time limit in seconds for solving each level.')
+    sample_parser.add_argument('--workers', type=int, default=None, help='With --min-playability, number of worker processes.')
+    sample_parser.add_argument('--output', type=str, default='generated.json', help='Output json file of name -> rows.')
+
+    args = parser.parse_args()
+
+    if args.command == 'train':
+        model = train(args.sources, args.n, args.height)
+        model.save(args.output)
+        print('%d-gram model with %d columns and %d contexts in %s' % (model.n, len(model.vocab), len(model.contexts), args.output))
+
+    elif args.command == 'sample':
+        model = NGramModel.load(args.model)
+
+        start = time.perf_counter()
+        if args.min_playability is None:
+            levels = generate(model, args.count, args.width, args.seed)
+        else:
+            levels = generate_playable(model, args.count, args.width, args.min_playability, args.seed, args.thorough, args.flaw, args.timeout, args.workers, args.max_tries)
+
+        output: Dict[str, List[str]] = {}
+        for rows in levels:
+            output['%dgram-%d' % (model.n, len(output))] = rows
+        elapsed = time.perf_counter() - start
+
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=1)
+        print('%d levels in %.2fs, output in %s' % (len(output), elapsed, args.output))
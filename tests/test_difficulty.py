@@ -0,0 +1,48 @@
+import json
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import difficulty
+
+def write_levels(path: str, keys: list) -> None:
+    with open(os.path.join(ROOT, 'difficulty', 'output.json')) as f:
+        levels = json.load(f)
+    with open(path, 'w') as f:
+        json.dump({key: levels[key] for key in keys}, f)
+
+def read(out_dir: str, name: str) -> str:
+    with open(os.path.join(out_dir, name)) as f:
+        return f.read()
+
+def test_resume_trims_unfinished_level(tmp_path) -> None:
+    out_dir = str(tmp_path)
+    sources = os.path.join(out_dir, 'levels.json')
+
+    write_levels(sources, ['2_8', '1_5', '6_4'])
+    difficulty.run_pipeline([sources], out_dir, workers=1)
+    expected = {name: read(out_dir, name) for name in [difficulty.READABLE_FILE, difficulty.BASELINE_FILE, difficulty.COMPUTATION_FILE]}
+
+    # a crash while writing 6_4, after its output.txt block and baseline row but before its CSV row
+    write_levels(sources, ['2_8', '1_5'])
+    difficulty.run_pipeline([sources], out_dir, workers=1, restart=True)
+    with open(os.path.join(out_dir, difficulty.READABLE_FILE), 'a') as f:
+        f.write('Level: 6_4\n0,1,')
+    with open(os.path.join(out_dir, difficulty.BASELINE_FILE), 'a') as f:
+        f.write('6_4,3.')
+
+    write_levels(sources, ['2_8', '1_5', '6_4'])
+    difficulty.run_pipeline([sources], out_dir, workers=1)
+    for name, text in expected.items():
+        assert read(out_dir, name) == text
+
+def test_batch_features_match_single_levels() -> None:
+    with open(os.path.join(ROOT, 'difficulty', 'output.json')) as f:
+        levels = json.load(f)
+    items = [(key, levels[key]) for key in ['2_8', '13_1', '1_5']]
+    items.append(('flat', difficulty.dungeongrams.Game.readrows(os.path.join(ROOT, 'levels', 'full', 'flat.txt'))))
+
+    batched = difficulty.batch_features([difficulty.solve_level(lvl_key, level) for lvl_key, level in items])
+    assert batched == [difficulty.level_features(lvl_key, level) for lvl_key, level in items]
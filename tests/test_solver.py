@@ -0,0 +1,82 @@
+import json
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import dungeongrams
+
+def level_path(*parts: str) -> str:
+    return os.path.join(ROOT, *parts)
+
+def test_quick_scores_match_baseline() -> None:
+    # which of several equal priority states is expanded first decides these levels in quick mode
+    assert dungeongrams.percent_playable(level_path('train', 'c02.txt'), True, True, False, dungeongrams.FLAW_NO_FLAW, use_cache=False) == 1.0
+    assert dungeongrams.percent_playable(level_path('train', 'c13.txt'), True, True, False, dungeongrams.FLAW_NO_FLAW, use_cache=False) == pytest.approx(0.468)
+
+def test_thorough_path_matches_baseline() -> None:
+    didwin, _, _, _, positions, stamina = dungeongrams.solve_and_run(level_path('train', 'c02.txt'), True, True, True, dungeongrams.FLAW_NO_FLAW, False, False, use_cache=False)
+    assert didwin
+    assert len(positions) == 68
+    assert stamina == 6
+
+def test_segmented_bucket_distance() -> None:
+    # the distance heuristic rules out states with inf, which the bucket frontier cannot hold
+    for frontier in dungeongrams.FRONTIERS:
+        assert dungeongrams.percent_playable(level_path('levels', 'full', 'long.txt'), True, False, False, dungeongrams.FLAW_NO_FLAW, use_cache=False,
+                                             heuristic=dungeongrams.HEURISTIC_DISTANCE, segment=10, frontier=frontier) == 1.0
+
+@pytest.mark.parametrize('segment', [1, 0, -3])
+def test_segment_too_narrow(segment: int) -> None:
+    with pytest.raises(RuntimeError):
+        dungeongrams.percent_playable(level_path('levels', 'full', 'long.txt'), True, False, False, dungeongrams.FLAW_NO_FLAW, use_cache=False, segment=segment)
+    response = dungeongrams.serve_request({'id': 1, 'rows': dungeongrams.Game.readrows(level_path('levels', 'full', 'long.txt')), 'segment': segment})
+    assert 'error' in response
+
+def serve_or_crash(request: dict) -> dict:
+    if request.get('crash'):
+        os._exit(1)
+    return {'id': request['id'], 'playability': 1.0}
+
+def test_server_survives_worker_crash(monkeypatch: pytest.MonkeyPatch) -> None:
+    # a request that kills its worker gets an error, and the requests sharing its pool are still solved
+    monkeypatch.setattr(dungeongrams, 'serve_request', serve_or_crash)
+    rows = dungeongrams.Game.readrows(level_path('levels', 'full', 'long.txt'))
+    lines = [json.dumps({'id': ii, 'rows': rows, 'crash': ii == 3}) for ii in range(8)] + [json.dumps({'id': 8, 'rows': rows, 'segment': 0})]
+
+    server = dungeongrams.SolveServer(2)
+    try:
+        output = []
+        server.serve_lines(lines, output.append)
+        server.serve_lines(lines[:3], output.append)
+    finally:
+        server.close()
+
+    responses = {}
+    for line in output:
+        response = json.loads(line)
+        responses.setdefault(response['id'], []).append(response)
+    assert 'worker failed' in responses[3][0]['error']
+    assert 'segment' in responses[8][0]['error']
+    for ii in [0, 1, 2, 4, 5, 6, 7]:
+        assert all(response.get('playability') == 1.0 for response in responses[ii])
+
+def test_anytime_stops_once_solution_is_optimal(monkeypatch: pytest.MonkeyPatch) -> None:
+    # the pass after the first solution searches everything under its cost, which proves that solution optimal
+    passes = []
+    dosolve = dungeongrams.dosolve
+    def counting_dosolve(*args, **kwargs):
+        passes.append(args)
+        return dosolve(*args, **kwargs)
+    monkeypatch.setattr(dungeongrams, 'dosolve', counting_dosolve)
+
+    stats = dungeongrams.SolveStats()
+    didwin, _, _, _, positions, _ = dungeongrams.solve_and_run(level_path('levels', 'full', 'flat.txt'), True, False, False, dungeongrams.FLAW_NO_FLAW, False, False,
+                                                               use_cache=False, stats=stats, budget_ms=60000)
+    assert didwin
+    assert len(positions) == 5
+    assert len(passes) == 2
+    assert stats.stop_reason == dungeongrams.STOP_EXHAUSTED